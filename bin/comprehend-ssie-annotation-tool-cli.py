@@ -4,28 +4,40 @@
 """Script used to create a Sagemaker GroundTruth labeling job for semi-structured documents."""
 
 import argparse
+import io
+import itertools
 import json
 import os
-import shutil
+import re
 import logging
 import datetime
-from typing import List
-import uuid
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional
 
-import pdfplumber
 import boto3
+from botocore.exceptions import ClientError
+import orjson
+from PyPDF2.utils import PdfReadError
 
-from utils.s3_helper import S3Client
+from utils.s3_helper import S3Client, get_boto3_client_config
 from utils.output_manifest_utils import is_an_expired_task
+from utils.pdf_utils import get_pdf_page_count_from_stream
 from constants import general
-from type.groundtruth_annotation_ui_config import GroundTruthAnnotationUIConfig, AnnotationUITaskSchemas, NamedEntitiesAnnotationTaskConfig
-from type.semi_structured_input_manifest import SemiStructuredInputManifestObject
+from type.groundtruth_annotation_ui_config import GroundTruthAnnotationUIConfig
+from type.semi_structured_input_manifest import create_input_manifest_object
 from type.semi_structured_output_manifest import SemiStructuredOutputManifestObject, SemiStructuredOutputManifestJobObject
 
 
 logging.basicConfig(level=logging.WARN)
 logger = logging.getLogger(__name__)
 
+# Serialized GroundTruthAnnotationUIConfig of the default NER schema, with the tags left to be filled in.
+DEFAULT_SCHEMA_CONTENT_TEMPLATE = '{"version": "SSIE_NER_SCHEMA_2021-04-15", "schemas": {"named_entity": {"annotation_task": "NER", "tags": %s, "properties": []}}, ' \
+    '"exported_time": "2021-04-15T17:34:34.493Z", "uuid": "f44b0438-72ac-43ac-bdc7-5727914522b9"}'
+ANNOTATOR_METADATA_PAIR_REGEX = re.compile(r'key=([^,]*),value=([^,]*)', re.IGNORECASE)
+ANNOTATOR_METADATA_REGEX = re.compile(r'key=[^,]*,value=[^,]*(?:,key=[^,]*,value=[^,]*)*', re.IGNORECASE)
+
 
 class InvalidAnnotatorMetadataException(Exception):
     """Raise when invalid annotator metadata is given."""
@@ -43,31 +55,16 @@ class NoFilesInDirectoryException(Exception):
         super().__init__(message)
 
 
-def cleanup(temp_path: str):
-    """Recursively delete all files and folders in path."""
-    if os.path.exists(temp_path):
-        shutil.rmtree(temp_path)
-
-
 def validate_and_format_annotator_metadata(annotator_metadata_str: str):
     """Validate metadata passed in through arguments to be shown to the annotator."""
-    annotator_metadata = dict()
-    annotator_metadata_parts = annotator_metadata_str.split(',')
-    if len(annotator_metadata_parts) >= 2:
-        key_value_array = [annotator_metadata_parts[i:i + 2] for i in range(0, len(annotator_metadata_parts), 2)]
-        try:
-            for key_str, val_str in key_value_array:
-                if not (key_str.lower().startswith('key=') and val_str.lower().startswith('value=')):
-                    raise InvalidAnnotatorMetadataException()
-                annotator_metadata[key_str.split('=')[1]] = val_str.split('=')[1]
-        except ValueError:
-            raise InvalidAnnotatorMetadataException()
-        return annotator_metadata
-    raise InvalidAnnotatorMetadataException()
+    if not ANNOTATOR_METADATA_REGEX.fullmatch(annotator_metadata_str):
+        raise InvalidAnnotatorMetadataException()
+    return dict(ANNOTATOR_METADATA_PAIR_REGEX.findall(annotator_metadata_str))
 
 
+@functools.lru_cache(maxsize=8)
 def describe_sagemaker_labeling_job(sagemaker_client, job_name: str):
-    """Call Sagemaker's describe-labeling-job API on a job."""
+    """Call Sagemaker's describe-labeling-job API on a job. Responses are cached per client and job name."""
     labeling_job_response = sagemaker_client.describe_labeling_job(LabelingJobName=job_name)
     return labeling_job_response
 
@@ -86,51 +83,54 @@ def get_output_manifest_ref_from_sagemaker_job(sagemaker_client, job_name: str):
     return output_manifest_ref
 
 
-def generate_manifest_jsons_from_previous_jobs(s3_client: S3Client, sagemaker_client, primary_output_manifest_contents: str,
+def generate_manifest_jsons_from_previous_jobs(primary_output_manifest_contents: str, secondary_output_manifest_contents: Optional[str],
                                                labels: List, annotator_metadata: dict, args):
     """Generate manifest json lines given previous jobs."""
     manifest_json_list = []
-    if args.blind2_labeling_job_name:
-        secondary_output_manifest_s3_ref = get_output_manifest_ref_from_sagemaker_job(sagemaker_client, args.blind2_labeling_job_name)
-        secondary_output_manifest_contents = s3_client.get_object_content_from_s3(secondary_output_manifest_s3_ref)
-        secondary_output_manifest_lines = secondary_output_manifest_contents.splitlines()
-
-    for idx, manifest_line in enumerate(primary_output_manifest_contents.splitlines()):
-        primary_output_manifest_json_obj = json.loads(manifest_line)
-        primary_output_manifest_obj = SemiStructuredOutputManifestObject(json_obj=primary_output_manifest_json_obj, job_name=args.blind1_labeling_job_name)
+    # Stream both manifests line by line in lockstep instead of materializing a list of lines for each of them.
+    primary_output_manifest_lines = io.StringIO(primary_output_manifest_contents)
+    secondary_output_manifest_lines = io.StringIO(secondary_output_manifest_contents if args.blind2_labeling_job_name else '')
+    primary_job_name, secondary_job_name = args.blind1_labeling_job_name, args.blind2_labeling_job_name
+    only_include_expired_tasks = args.only_include_expired_tasks
+    empty_job_object = SemiStructuredOutputManifestJobObject({})
+
+    for manifest_line, secondary_manifest_line in itertools.zip_longest(primary_output_manifest_lines, secondary_output_manifest_lines, fillvalue=''):
+        if not manifest_line.strip():
+            continue
+        primary_output_manifest_obj = SemiStructuredOutputManifestObject(json_obj=orjson.loads(manifest_line), job_name=primary_job_name)
+        primary_output_manifest_fields = vars(primary_output_manifest_obj)
 
-        if args.only_include_expired_tasks:
-            if not is_an_expired_task(primary_output_manifest_obj, args.blind1_labeling_job_name):
+        if only_include_expired_tasks:
+            if not is_an_expired_task(primary_output_manifest_obj, primary_job_name):
                 continue
 
-            primary_annotation_ref = getattr(primary_output_manifest_obj, "primary-annotation-ref")
-            secondary_annotation_ref = getattr(primary_output_manifest_obj, "secondary-annotation-ref")
+            primary_annotation_ref = primary_output_manifest_fields["primary-annotation-ref"]
+            secondary_annotation_ref = primary_output_manifest_fields["secondary-annotation-ref"]
         else:
-            primary_output_manifest_job_object = getattr(primary_output_manifest_obj, str(args.blind1_labeling_job_name), SemiStructuredOutputManifestJobObject({}))
-            primary_annotation_ref = getattr(primary_output_manifest_job_object, "annotation-ref")
+            primary_annotation_ref = getattr(primary_output_manifest_fields.get(str(primary_job_name), empty_job_object), "annotation-ref")
 
-            secondary_output_manifest_json_obj = json.loads(secondary_output_manifest_lines[idx]) if args.blind2_labeling_job_name else {}
-            secondary_output_manifest_obj = SemiStructuredOutputManifestObject(json_obj=secondary_output_manifest_json_obj, job_name=args.blind2_labeling_job_name)
-            secondary_output_manifest_job_object = getattr(secondary_output_manifest_obj, str(args.blind2_labeling_job_name), SemiStructuredOutputManifestJobObject({}))
-            secondary_annotation_ref = getattr(secondary_output_manifest_job_object, "annotation-ref")
+            secondary_output_manifest_json_obj = orjson.loads(secondary_manifest_line) if secondary_manifest_line.strip() else {}
+            secondary_output_manifest_obj = SemiStructuredOutputManifestObject(json_obj=secondary_output_manifest_json_obj, job_name=secondary_job_name)
+            secondary_annotation_ref = getattr(vars(secondary_output_manifest_obj).get(str(secondary_job_name), empty_job_object), "annotation-ref")
 
-        manifest_json = SemiStructuredInputManifestObject(
-            source_ref=getattr(primary_output_manifest_obj, "source-ref"),
-            page=primary_output_manifest_obj.page,
+        manifest_json = create_input_manifest_object(
+            source_ref=primary_output_manifest_fields["source-ref"],
+            page=primary_output_manifest_fields["page"],
+            # The metadata only holds flat values besides the labels, which are replaced, so a shallow copy is enough.
             metadata={
-                **getattr(primary_output_manifest_obj, "metadata").to_dict(),
+                **vars(primary_output_manifest_fields["metadata"]),
                 "labels": labels
             },
             annotator_metadata=annotator_metadata,
             primary_annotation_ref=primary_annotation_ref,
             secondary_annotation_ref=secondary_annotation_ref
         )
-        manifest_json_list.append(manifest_json.__dict__)
+        manifest_json_list.append(manifest_json)
     return manifest_json_list
 
 
-def validate_and_download_from_input_s3_path(s3_client: S3Client, ssie_documents_s3_bucket: str, args):
-    """Validate the inputted S3 path and download the files locally. Returns the S3 and local paths."""
+def validate_and_list_from_input_s3_path(s3_client: S3Client, ssie_documents_s3_bucket: str, args):
+    """Validate the inputted S3 path and list the PDFs under it. Returns the input bucket and the sorted PDF keys."""
     input_s3_path = args.input_s3_path.rstrip('/')
     if not input_s3_path:
         raise ValueError('An input S3 path is required for NON-verification jobs, but none was given.')
@@ -140,21 +140,16 @@ def validate_and_download_from_input_s3_path(s3_client: S3Client, ssie_documents
         raise ValueError(f'Please specify a s3 input path under {ssie_documents_s3_bucket} to start a labeling job. '
                          f'Current input bucket is {input_bucket}.')
 
-    local_dir = f"/tmp/{uuid.uuid4()}"
-
-    s3_client.download_directory(local_dir_path=local_dir, bucket_name=input_bucket, s3_path_prefix=f'{input_key}/')
-
-    if not os.path.isdir(local_dir):
+    keys = sorted(s3_client.get_keys_from_s3(bucket=input_bucket, filter_prefix=f'{input_key}/', suffix='.pdf'))
+    if not keys:
         raise NoFilesInDirectoryException()
 
-    print(f'Downloaded files to temp local directory {local_dir}')
-
-    return (input_s3_path, local_dir)
+    return (input_bucket, keys)
 
 
 def get_labels_from_schema_content(content: str) -> List[str]:
     """Return schemas.named_entity.tags value from GroundTruthAnnotationUIConfig object."""
-    schema_obj = GroundTruthAnnotationUIConfig(**json.loads(content))
+    schema_obj = GroundTruthAnnotationUIConfig(**orjson.loads(content))
     return schema_obj.schemas.named_entity.tags
 
 
@@ -164,70 +159,78 @@ def get_labels_and_manifest(schema_content: str, args):
         labels = get_labels_from_schema_content(schema_content)
     else:
         labels = general.DEFAULT_LABELS if not args.entity_types else args.entity_types
-        schema_content = json.dumps(GroundTruthAnnotationUIConfig(
-            version="SSIE_NER_SCHEMA_2021-04-15",
-            schemas=AnnotationUITaskSchemas(
-                named_entity=NamedEntitiesAnnotationTaskConfig(
-                    annotation_task="NER",
-                    tags=labels,
-                    properties=[]
-                )
-            ),
-            exported_time="2021-04-15T17:34:34.493Z",
-            uuid="f44b0438-72ac-43ac-bdc7-5727914522b9"
-        ).dict())
+        schema_content = DEFAULT_SCHEMA_CONTENT_TEMPLATE % json.dumps(labels)
     return schema_content, labels
 
 
 def generate_manifest_jsons_and_schema_for_verification_job(sagemaker_client, s3_client: S3Client, ssie_documents_s3_bucket: str, annotator_metadata: dict, args):
     """Generate manifest jsons and schema for a verification job."""
     primary_output_manifest_s3_ref = get_output_manifest_ref_from_sagemaker_job(sagemaker_client, args.blind1_labeling_job_name)
-    primary_output_manifest_contents = s3_client.get_object_content_from_s3(primary_output_manifest_s3_ref)
+    secondary_output_manifest_s3_ref = get_output_manifest_ref_from_sagemaker_job(sagemaker_client, args.blind2_labeling_job_name) \
+        if args.blind2_labeling_job_name else None
 
     blind1_ui_template_root = get_ui_template_root_from_sagemaker_job(sagemaker_client, args.blind1_labeling_job_name)
     ui_schema_path_copy = f's3://{ssie_documents_s3_bucket}/comprehend-semi-structured-docs-ui-template/{blind1_ui_template_root}/ui-template/schema.json'
     print(f'Using UI schema path: {ui_schema_path_copy}')
-    schema_content = s3_client.get_object_content_from_s3(ui_schema_path_copy)
+
+    # The output manifests and the schema are independent objects, so fetch them concurrently.
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        primary_output_manifest_future = executor.submit(s3_client.get_object_content_from_s3, primary_output_manifest_s3_ref)
+        schema_future = executor.submit(s3_client.get_object_content_from_s3, ui_schema_path_copy)
+        secondary_output_manifest_future = executor.submit(s3_client.get_object_content_from_s3, secondary_output_manifest_s3_ref) \
+            if secondary_output_manifest_s3_ref else None
+
+        primary_output_manifest_contents = primary_output_manifest_future.result()
+        schema_content = schema_future.result()
+        secondary_output_manifest_contents = secondary_output_manifest_future.result() if secondary_output_manifest_future else None
 
     labels = get_labels_from_schema_content(schema_content)
 
-    manifest_json_list = generate_manifest_jsons_from_previous_jobs(s3_client, sagemaker_client, primary_output_manifest_contents, labels, annotator_metadata, args)
+    manifest_json_list = generate_manifest_jsons_from_previous_jobs(primary_output_manifest_contents, secondary_output_manifest_contents, labels, annotator_metadata, args)
     return manifest_json_list, schema_content
 
 
+def get_page_count_from_s3(s3_client: S3Client, bucket: str, key: str) -> Optional[int]:
+    """Return the number of pages of a PDF in S3 by reading only its trailer and page tree, or None if the file cannot be read."""
+    try:
+        return get_pdf_page_count_from_stream(s3_client.open_object(bucket, key))
+    except (PdfReadError, ClientError, KeyError, ValueError):
+        print(f'Unreadable file: s3://{bucket}/{key}. Skipping.')
+        return None
+
+
+def generate_manifest_jsons_for_pages(input_bucket: str, keys: List[str], page_counts: List[Optional[int]], use_textract_only: bool,
+                                      labels: List, annotator_metadata: dict) -> Iterator[dict]:
+    """Lazily generate one manifest json per page of each PDF, skipping the PDFs which could not be read."""
+    for key, page_count in zip(keys, page_counts):
+        if page_count is None:
+            continue
+        # Only the page differs between the rows of a PDF, so build the row once and copy it per page.
+        manifest_json = create_input_manifest_object(
+            source_ref=f's3://{input_bucket}/{key}',
+            metadata={
+                "pages": f'{page_count}',
+                "use-textract-only": use_textract_only,
+                "labels": labels
+            },
+            annotator_metadata=annotator_metadata
+        )
+        yield from ({**manifest_json, 'page': f'{i+1}'} for i in range(page_count))
+
+
 def generate_manifest_jsons_and_schema_for_standard_job(s3_client: S3Client, ssie_documents_s3_bucket: str, use_textract_only: bool, annotator_metadata: dict, args):
     """Generate manifest jsons and schema for a standard job."""
-    input_s3_path, local_dir = validate_and_download_from_input_s3_path(s3_client, ssie_documents_s3_bucket, args)
+    input_bucket, keys = validate_and_list_from_input_s3_path(s3_client, ssie_documents_s3_bucket, args)
 
     schema_content = s3_client.get_object_content_from_s3(args.schema_path) if args.schema_path else None
     schema_content, labels = get_labels_and_manifest(schema_content, args)
 
-    # Generate input manifest file for each page of PDF.
-    manifest_json_list = []
-    for file_name in os.listdir(local_dir):
-        file_path = os.path.join(local_dir, file_name)
-        try:
-            with pdfplumber.open(file_path) as pdf:
-                for i in range(len(pdf.pages)):
-                    manifest_json_obj = SemiStructuredInputManifestObject(
-                        source_ref=f'{input_s3_path}/{file_name}',
-                        page=f'{i+1}',
-                        metadata={
-                            "pages": f'{len(pdf.pages)}',
-                            "use-textract-only": use_textract_only,
-                            "labels": labels
-                        },
-                        annotator_metadata=annotator_metadata
-                    )
-                    manifest_json_list.append(manifest_json_obj.__dict__)
-        except Exception:
-            print(f'Unreadable file: {file_path}. Skipping.')
-            continue
-
-    cleanup(local_dir)
-    print(f'Deleted downloaded temp files from {local_dir}')
+    # Count the pages of each PDF in parallel, without downloading the documents.
+    with ThreadPoolExecutor(max_workers=general.S3_TRANSFER_MAX_WORKERS) as executor:
+        page_counts = list(executor.map(functools.partial(get_page_count_from_s3, s3_client, input_bucket), keys))
 
-    return manifest_json_list, schema_content
+    # Generate input manifest file for each page of PDF.
+    return generate_manifest_jsons_for_pages(input_bucket, keys, page_counts, use_textract_only, labels, annotator_metadata), schema_content
 
 
 def generate_manifest_jsons_and_schema(s3_client: S3Client, sagemaker_client, ssie_documents_s3_bucket: str,
@@ -237,7 +240,23 @@ def generate_manifest_jsons_and_schema(s3_client: S3Client, sagemaker_client, ss
         manifest_json_list, schema_content = generate_manifest_jsons_and_schema_for_verification_job(sagemaker_client, s3_client, ssie_documents_s3_bucket, annotator_metadata, args)
     else:
         manifest_json_list, schema_content = generate_manifest_jsons_and_schema_for_standard_job(s3_client, ssie_documents_s3_bucket, use_textract_only, annotator_metadata, args)
-    return (manifest_json_list, schema_content) if manifest_json_list else None
+
+    # The manifest jsons may be generated lazily, so peek at the first one to check that there is any.
+    manifest_jsons = iter(manifest_json_list)
+    first_manifest_json = next(manifest_jsons, None)
+    return (itertools.chain([first_manifest_json], manifest_jsons), schema_content) if first_manifest_json else None
+
+
+def labeling_job_exists(sagemaker_client, job_name: str) -> bool:
+    """Check if a labeling job exists by listing the jobs whose name contains job_name. Job names are compared case-insensitively."""
+    list_labeling_jobs_request = {'NameContains': job_name, 'MaxResults': 100}
+    while True:
+        response = sagemaker_client.list_labeling_jobs(**list_labeling_jobs_request)
+        if any(job['LabelingJobName'].lower() == job_name.lower() for job in response.get('LabelingJobSummaryList', [])):
+            return True
+        if not response.get('NextToken'):
+            return False
+        list_labeling_jobs_request['NextToken'] = response['NextToken']
 
 
 def validate_groundtruth_labeling_job_name(sagemaker_client, job_name_prefix: str, no_suffix: bool):
@@ -246,11 +265,8 @@ def validate_groundtruth_labeling_job_name(sagemaker_client, job_name_prefix: st
     now_str = now.strftime('%Y%m%dT%H%M%S')
     if no_suffix:
         ground_truth_labeling_job_name = job_name_prefix
-        try:
-            describe_sagemaker_labeling_job(sagemaker_client, ground_truth_labeling_job_name)
+        if labeling_job_exists(sagemaker_client, ground_truth_labeling_job_name):
             return None
-        except Exception:
-            pass
     else:
         ground_truth_labeling_job_name = f'{job_name_prefix}-labeling-job-{now_str}'
     return ground_truth_labeling_job_name
@@ -289,8 +305,9 @@ def main():
     annotator_metadata = validate_and_format_annotator_metadata(annotator_metadata_str) if annotator_metadata_str else None
 
     session = boto3.Session(region_name=region)
-    sts = session.client('sts')
-    cfn = session.client('cloudformation')
+    boto3_client_config = get_boto3_client_config()
+    sts = session.client('sts', config=boto3_client_config)
+    cfn = session.client('cloudformation', config=boto3_client_config)
 
     account_id = sts.get_caller_identity().get('Account')
     workteam_arn = f"arn:aws:sagemaker:{region}:{account_id}:workteam/private-crowd/{args.work_team_name}"
@@ -311,8 +328,8 @@ def main():
         if not args.create_input_manifest_only:
             print('Please enter correct cloudformation stack name deployed by comprehend-semi-structured-documents-annotation-template.')
             return
-    s3_client = S3Client()
-    sagemaker_client = session.client('sagemaker')
+    s3_client = S3Client(session=session, config=boto3_client_config)
+    sagemaker_client = session.client('sagemaker', config=boto3_client_config)
 
     ground_truth_labeling_job_name = validate_groundtruth_labeling_job_name(sagemaker_client=sagemaker_client, job_name_prefix=args.job_name_prefix, no_suffix=args.no_suffix)
     if not ground_truth_labeling_job_name:
@@ -332,30 +349,38 @@ def main():
         return
     manifest_json_list, schema_content = generated_data
 
-    # Upload input manifest
     input_manifest_path = f's3://{ssie_documents_s3_bucket}/input-manifest/{ground_truth_labeling_job_name}.manifest'
-    print('Uploading input manifest file.')
-    s3_client.write_jsonl(s3_path=input_manifest_path, rows=manifest_json_list)
-
-    if args.create_input_manifest_only:
-        return
-
-    # Upload ui artifacts
     ui_template_s3_path_prefix = f'comprehend-semi-structured-docs-ui-template/{ground_truth_labeling_job_name}'
     local_ui_template_directory_name = 'ui-template'
-    s3_client.upload_directory(local_dir_path=local_ui_template_directory_name, bucket_name=ssie_documents_s3_bucket, s3_path_prefix=ui_template_s3_path_prefix)
-
-    # Upload the annotation schema file
     ui_schema_path = f's3://{ssie_documents_s3_bucket}/{ui_template_s3_path_prefix}/{local_ui_template_directory_name}/schema.json'
-    print('Uploading schema file.')
-    s3_client.write_content(content=schema_content, s3_path=ui_schema_path)
-
-    # Upload the UI template file
     ui_template_path = f's3://{ssie_documents_s3_bucket}/{ui_template_s3_path_prefix}/{local_ui_template_directory_name}/template-2021-04-15.liquid'
-    with open(f'./{local_ui_template_directory_name}/index.html', encoding='utf-8') as template:
-        template_file = template.read().replace('TO_BE_REPLACE', f'{ssie_documents_s3_bucket}/{ui_template_s3_path_prefix}')
-        print('Uploading template UI.')
-        s3_client.write_content(content=template_file, s3_path=ui_template_path)
+
+    # The uploads are independent of each other, so run them concurrently and wait for all of them before starting the job.
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        # Upload input manifest
+        print('Uploading input manifest file.')
+        futures = [executor.submit(s3_client.write_jsonl, s3_path=input_manifest_path, rows=manifest_json_list)]
+
+        if not args.create_input_manifest_only:
+            # Upload ui artifacts
+            futures.append(executor.submit(s3_client.upload_directory, local_dir_path=local_ui_template_directory_name, bucket_name=ssie_documents_s3_bucket,
+                                           s3_path_prefix=f'{ui_template_s3_path_prefix}/{local_ui_template_directory_name}'))
+
+            # Upload the annotation schema file
+            print('Uploading schema file.')
+            futures.append(executor.submit(s3_client.write_content, content=schema_content, s3_path=ui_schema_path))
+
+            # Upload the UI template file
+            with open(f'./{local_ui_template_directory_name}/index.html', encoding='utf-8') as template:
+                template_file = template.read().replace('TO_BE_REPLACE', f'{ssie_documents_s3_bucket}/{ui_template_s3_path_prefix}')
+            print('Uploading template UI.')
+            futures.append(executor.submit(s3_client.write_content, content=template_file, s3_path=ui_template_path))
+
+        for future in futures:
+            future.result()
+
+    if args.create_input_manifest_only:
+        return
 
     # Start a Sagemaker Groundtruth labeling job
     human_task_config = {
@@ -5,4 +5,16 @@
 
 VERSION = "2021-04-30"
 TOTAL_IMAGE_SIZE_TO_PAGE_SIZE_RATIO_THRESHOLD = 0.25
+S3_TRANSFER_MAX_WORKERS = 32
+CONSOLIDATION_MAX_WORKERS = 16
+S3_LIST_MAX_WORKERS = 16
+PRE_HUMAN_TASK_MAX_WORKERS = 4
+BLOCKS_CACHE_FOLDER = "comprehend-semi-structured-docs-intermediate-output/blocks-cache"
+S3_MAX_POOL_CONNECTIONS = 64
+S3_MULTIPART_THRESHOLD_BYTES = 16 * 1024 * 1024
+S3_TRANSFER_MAX_CONCURRENCY = 10
+JSONL_SPOOL_MAX_SIZE_BYTES = 64 * 1024 * 1024
+S3_RANGE_READ_BLOCK_SIZE_BYTES = 64 * 1024
+BOTO3_RETRY_MODE = 'standard'
+BOTO3_MAX_ATTEMPTS = 5
 DEFAULT_LABELS = ["PER", "LOC", "ORG", "FAC", "BRAND", "COMM", "TITLE:MOVIE", "TITLE:MUSIC", "TITLE:BOOK", "TITLE:SOFT", "TITLE:GAME", "TITLE:OTHER", "PERSON:TITLE", "QUANT", "IDENTITY", "OTHER"]
@@ -2,38 +2,50 @@
 # SPDX-License-Identifier: MIT-0
 
 """Annotation Consolidation lambda."""
-import json
+import functools
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import List, Dict
-import uuid
+from typing import List, Dict, Optional
+import secrets
 import html
 
+import orjson
+
 from utils.s3_helper import S3Client
+from constants import general
 from type.semi_structured_annotation import SemiStructuredAnnotation
 
 
+@functools.lru_cache(maxsize=1)
+def get_s3_client() -> S3Client:
+    """Return the S3 client, created once per Lambda execution environment and reused across warm invocations."""
+    return S3Client()
+
+
 def remove_block_indices_from_blocks(blocks: List[dict]):
     """Remove parentBlockIndex and blockIndex from blocks."""
     for b in blocks:
-        if 'parentBlockIndex' in b:
-            del b['parentBlockIndex']
-        if 'blockIndex' in b:
-            del b['blockIndex']
+        b.pop('parentBlockIndex', None)
+        b.pop('blockIndex', None)
     return blocks
 
 
 def get_blocks_from_s3_ref(blocks_s3_ref: str, s3_client: S3Client) -> List:
     """Return a list of blocks from an S3 reference file."""
-    blocks = [] if not blocks_s3_ref else json.loads(s3_client.get_object_content_from_s3(blocks_s3_ref))
+    blocks = [] if not blocks_s3_ref else orjson.loads(s3_client.get_object_bytes_from_s3(blocks_s3_ref))
     return remove_block_indices_from_blocks(blocks)
 
 
 def get_annotation_obj(annotation_obj_str: str, s3_client: S3Client, file_name: str) -> SemiStructuredAnnotation:
     """Return a transformed annotations object to be written."""
-    annotation_obj = SemiStructuredAnnotation(**json.loads(annotation_obj_str))
+    annotation_obj = SemiStructuredAnnotation(**orjson.loads(annotation_obj_str))
     annotation_obj.BlocksS3Ref = html.unescape(annotation_obj.BlocksS3Ref)
-    annotation_obj.Blocks = get_blocks_from_s3_ref(annotation_obj.BlocksS3Ref, s3_client)
+    if annotation_obj.BlocksS3Ref:
+        annotation_obj.Blocks = get_blocks_from_s3_ref(annotation_obj.BlocksS3Ref, s3_client)
+    else:
+        # Blocks inlined in the worker response need no S3 round trip.
+        annotation_obj.Blocks = remove_block_indices_from_blocks(annotation_obj.Blocks)
     page_number = annotation_obj.DocumentMetadata.PageNumber
     annotation_file_name = get_annotation_file_name(file_name, page_number)
     annotation_obj.File = annotation_file_name
@@ -42,68 +54,79 @@ def get_annotation_obj(annotation_obj_str: str, s3_client: S3Client, file_name:
 
 def get_annotation_file_name(file_name: str, page_number: str):
     """Generate an annotation file name."""
-    return f"{S3Client.remove_extension(file_name)}-{str(page_number)}-{str(uuid.uuid4())[:8]}-ann.json"
+    return f"{S3Client.remove_extension(file_name)}-{page_number}-{secrets.token_hex(4)}-ann.json"
 
 
-def get_annotation_file_path(s3_ref: str, annotation_file_name: str):
-    """Generate an annotation file path."""
-    s3_output_path_prefix, iteration = os.path.split(os.path.split(s3_ref)[0])
-    return f"{os.path.split(s3_output_path_prefix)[0]}/consolidation-response/{iteration}/annotations/{annotation_file_name}"
+def get_annotations_s3_prefix(s3_ref: str):
+    """Return the S3 prefix annotations are written under, given the s3 path of the consolidation request json."""
+    s3_output_path_prefix, _, iteration, _ = s3_ref.rsplit('/', 3)
+    return f"{s3_output_path_prefix}/consolidation-response/{iteration}/annotations"
 
 
 def write_annotations(annotations_obj: SemiStructuredAnnotation, annotation_file_path: str, s3_client: S3Client):
     """Given a s3 path of consolidation request json, return a s3 folder we use to save annotations."""
-    s3_client.write_content(s3_path=annotation_file_path, content=json.dumps(annotations_obj.dict()))
+    s3_client.write_content(s3_path=annotation_file_path, content=orjson.dumps(annotations_obj.dict()))
     print(f"Wrote annotations to {annotation_file_path}")
 
 
-def do_consolidation(payload: List[Dict], s3_client: S3Client, labeling_job_arn: str, label_attribute_name: str, s3_ref: str):
-    """Consolidation methods for converting gt output to uf format."""
-    consolidated_output = []
-
-    for data_object_response in payload:
-        try:
-            # data_object_response: annotations from workers for a document.
-            annotation_list: List[dict] = data_object_response["annotations"]
-            annotation_file_path = ""
-            # contains one worker per labeling job
-            if annotation_list:
-                annotation_map = json.loads(
-                    annotation_list[0]["annotationData"]["content"]
-                )
-                if "document" in annotation_map:  # Workers can return empty responses
-                    file_name = os.path.split(data_object_response["dataObject"]["s3Uri"])[1]
-                    annotations_obj = get_annotation_obj(annotation_map["document"], s3_client, file_name)
-                    annotation_file_path = get_annotation_file_path(s3_ref, annotations_obj.File)
-                    #  write annotation file
-                    write_annotations(annotations_obj, annotation_file_path, s3_client)
-
-            #  return reference to s3
-            response = {
-                "datasetObjectId": data_object_response["datasetObjectId"],
-                "consolidatedAnnotation": {
-                    "content": {
-                        label_attribute_name: {
-                            "annotation-ref": annotation_file_path
-                        },
-                        label_attribute_name + "-metadata": {
-                            "job-name": labeling_job_arn.split(":")[5],
-                            "type": "groundtruth/pdf-ner",
-                            "creation-date": datetime.utcnow().isoformat(),
-                            "human-annotated": "yes",
-                        },
-                    }
-                },
-            }
+def consolidate_data_object(data_object_response: Dict, s3_client: S3Client, job_name: str, label_attribute_name: str,
+                            annotations_s3_prefix: Optional[str], creation_date: str) -> Optional[Dict]:
+    """Convert the gt output of a single data object to uf format. Returns None if the data object could not be consolidated."""
+    try:
+        # data_object_response: annotations from workers for a document.
+        annotation_list: List[dict] = data_object_response["annotations"]
+        annotation_file_path = ""
+        # contains one worker per labeling job
+        if annotation_list:
+            annotation_map = orjson.loads(
+                annotation_list[0]["annotationData"]["content"]
+            )
+            if "document" in annotation_map:  # Workers can return empty responses
+                file_name = os.path.split(data_object_response["dataObject"]["s3Uri"])[1]
+                annotations_obj = get_annotation_obj(annotation_map["document"], s3_client, file_name)
+                if not annotations_s3_prefix:
+                    raise ValueError('No consolidation request S3 path to write the annotations next to.')
+                annotation_file_path = f"{annotations_s3_prefix}/{annotations_obj.File}"
+                #  write annotation file
+                write_annotations(annotations_obj, annotation_file_path, s3_client)
+
+        #  return reference to s3
+        return {
+            "datasetObjectId": data_object_response["datasetObjectId"],
+            "consolidatedAnnotation": {
+                "content": {
+                    label_attribute_name: {
+                        "annotation-ref": annotation_file_path
+                    },
+                    label_attribute_name + "-metadata": {
+                        "job-name": job_name,
+                        "type": "groundtruth/pdf-ner",
+                        "creation-date": creation_date,
+                        "human-annotated": "yes",
+                    },
+                }
+            },
+        }
 
-            # Append individual data object response to the list of responses.
-            if response is not None:
-                consolidated_output.append(response)
+    except Exception as e:
+        print(f'An Error occurred in do_consolidation function: {e}')
+        return None
 
-        except Exception as e:
-            print(f'An Error occurred in do_consolidation function: {e}')
 
-    print(consolidated_output)
+def do_consolidation(payload: List[Dict], s3_client: S3Client, labeling_job_arn: str, label_attribute_name: str, s3_ref: str):
+    """Consolidation methods for converting gt output to uf format. Data objects are consolidated concurrently."""
+    annotations_s3_prefix = get_annotations_s3_prefix(s3_ref) if s3_ref else None
+    # All data objects of a consolidation request share the same creation date.
+    creation_date = datetime.utcnow().isoformat()
+    job_name = labeling_job_arn.split(":")[5]
+    consolidate = functools.partial(consolidate_data_object, s3_client=s3_client, job_name=job_name,
+                                    label_attribute_name=label_attribute_name, annotations_s3_prefix=annotations_s3_prefix,
+                                    creation_date=creation_date)
+    with ThreadPoolExecutor(max_workers=general.CONSOLIDATION_MAX_WORKERS) as executor:
+        # Append individual data object responses to the list of responses, in payload order.
+        consolidated_output = [response for response in executor.map(consolidate, payload) if response is not None]
+
+    print(f"Consolidated {len(consolidated_output)} of {len(payload)} data objects.")
 
     return consolidated_output
 
@@ -171,18 +194,18 @@ def lambda_handler(event, context):
 
     """
     # Event received
-    print("Received event: " + json.dumps(event, indent=2))
+    print("Received event: " + orjson.dumps(event).decode("utf-8"))
     labeling_job_arn = event["labelingJobArn"]
     label_attribute_name = event["labelAttributeName"]
 
     payload = event["payload"]
 
-    s3_client = S3Client()
+    s3_client = get_s3_client()
 
     s3_ref = None
     if "s3Uri" in payload:
         s3_ref = payload["s3Uri"]
-        payload = json.loads(s3_client.get_object_content_from_s3(s3_ref))
+        payload = orjson.loads(s3_client.get_object_bytes_from_s3(s3_ref))
 
     # Perform consolidation
     return do_consolidation(payload, s3_client, labeling_job_arn, label_attribute_name, s3_ref)
@@ -3,31 +3,52 @@
 
 """Pre Human Lambda function handler."""
 import io
-import json
 import os
 import base64
+import functools
+import hashlib
 from io import BytesIO
-from typing import List, Union
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
 import traceback
 
-import pdfplumber
+import orjson
+from botocore.exceptions import ClientError
 
 from utils.s3_helper import S3Client
-from utils.block_helper import JSONHandler, Geometry, Block, Relationship
+from utils.block_helper import JSONHandler, Geometry, Block, Relationship, union_bounding_boxes
 from constants import general
 from type.semi_structured_annotation import SemiStructuredAnnotation, SemiStructuredDocumentType
 from utils.textract_helper import TextractClient
 from utils.pdf_utils import get_pdf_page_bytes
 
 
+@functools.lru_cache(maxsize=1)
+def get_s3_client() -> S3Client:
+    """Return the S3 client, created once per Lambda execution environment and reused across warm invocations."""
+    return S3Client()
+
+
+@functools.lru_cache(maxsize=1)
+def get_textract_client() -> TextractClient:
+    """Return the Textract client, created on first use and reused across warm invocations."""
+    return TextractClient()
+
+
 def is_scanned_pdf(images, page_width: float, page_height: float):
     """Return whether a PDF is a scanned PDF given its images and page dimensions."""
     page_size = page_width * page_height
     if len(images) >= 1:
         print(f'Total number of images in a single PDF page {len(images)}')
         image_size_total = 0
-        for image in images:
+        image_size_threshold = general.TOTAL_IMAGE_SIZE_TO_PAGE_SIZE_RATIO_THRESHOLD * page_size
+        for image_count, image in enumerate(images, start=1):
             image_size_total += float(image['width']) * float(image['height'])
+            # the remaining images cannot lower the ratio below the threshold, so the sum is partial from here on
+            if image_size_total >= image_size_threshold:
+                print(f"threshold = {general.TOTAL_IMAGE_SIZE_TO_PAGE_SIZE_RATIO_THRESHOLD} reached after {image_count} of {len(images)} images, "
+                      f"partial image_size_total = {image_size_total}, page_size = {page_size}")
+                return True
         image_size_to_page_size_ratio = image_size_total / page_size
         print(f"image_size_total = {image_size_total}, page_size = {page_size}, ratio = {image_size_to_page_size_ratio}, threshold = {general.TOTAL_IMAGE_SIZE_TO_PAGE_SIZE_RATIO_THRESHOLD}")
         return image_size_to_page_size_ratio >= general.TOTAL_IMAGE_SIZE_TO_PAGE_SIZE_RATIO_THRESHOLD
@@ -37,6 +58,9 @@ def is_scanned_pdf(images, page_width: float, page_height: float):
 
 def get_pdf_blocks(pdf_bytes: bytes, page_num: int, use_textract_only: bool, source_ref: str, textract_client: TextractClient):
     """Get the Block objects from a PDF and also return it's type."""
+    # pdfplumber is only imported when blocks are extracted, sparing its import on the previous annotation and cached blocks paths
+    import pdfplumber
+
     pdf_bytes_io = BytesIO(pdf_bytes)
     blocks = []
     is_native_pdf = False
@@ -45,8 +69,9 @@ def get_pdf_blocks(pdf_bytes: bytes, page_num: int, use_textract_only: bool, sou
     #   https://github.com/jsvine/pdfplumber/blob/ecc9e8e16dfc2cfc1fef0749ddb75198ab6594d4/pdfplumber/pdf.py
     #   https://github.com/jsvine/pdfplumber/blob/stable/pdfplumber/page.py
     try:
-        with pdfplumber.open(pdf_bytes_io) as pdf:
-            page = pdf.pages[page_num - 1]
+        # Only build the pdfplumber page object of the page to annotate
+        with pdfplumber.open(pdf_bytes_io, pages=[page_num]) as pdf:
+            page = pdf.pages[0]
             width, height = float(page.width), float(page.height)
 
             if use_textract_only or is_scanned_pdf(page.images, width, height):
@@ -67,22 +92,64 @@ def get_pdf_blocks(pdf_bytes: bytes, page_num: int, use_textract_only: bool, sou
     return blocks, is_native_pdf
 
 
-def output_pdf_temp_file_to_s3(s3_client: S3Client, source_ref: str, content: Union[bytes, list], page_num: int, job_id: str):
-    """Write a temporary file to a created S3 location and return the file key."""
+def get_pdf_temp_file_s3_ref(source_ref: str, page_num: int, job_id: str, suffix: str):
+    """Return the S3 reference of a temporary file created for a PDF page."""
     bucket, temp_folder_key = get_temp_folder_bucket_key_from_s3_uri(source_ref, job_id)
-    print(f'uploading data to bucket = {bucket}, path = {temp_folder_key}')
     _, pdf_key = S3Client.bucket_key_from_s3_uri(source_ref)
     pdf_key_file_name = S3Client.remove_extension(pdf_key).split('/')[-1]
-    if type(content) == bytes:
-        file_key = f'{temp_folder_key}/{pdf_key_file_name}_{page_num}_base64'
-    else:
-        file_key = f'{temp_folder_key}/{pdf_key_file_name}_{page_num}_blocks.json'
-        content = json.dumps(content, default=JSONHandler)
-    s3_write_path = f's3://{bucket}/{file_key}'
-    s3_client.write_content(s3_path=s3_write_path, content=content)
+    return f's3://{bucket}/{temp_folder_key}/{pdf_key_file_name}_{page_num}_{suffix}'
+
+
+def output_pdf_base64_temp_file_to_s3(s3_client: S3Client, source_ref: str, pdf_base64: bytes, page_num: int, job_id: str):
+    """Write the base64 encoded PDF page to a temporary file in S3 and return the file's S3 reference."""
+    s3_write_path = get_pdf_temp_file_s3_ref(source_ref, page_num, job_id, 'base64')
+    s3_client.write_content(s3_path=s3_write_path, content=pdf_base64)
     return s3_write_path
 
 
+def output_pdf_blocks_temp_file_to_s3(s3_client: S3Client, source_ref: str, pdf_blocks: list, page_num: int, job_id: str):
+    """Write the blocks of the PDF page to a temporary JSON file in S3 and return the file's S3 reference."""
+    s3_write_path = get_pdf_temp_file_s3_ref(source_ref, page_num, job_id, 'blocks.json')
+    s3_client.write_content(s3_path=s3_write_path, content=orjson.dumps(pdf_blocks, default=JSONHandler))
+    return s3_write_path
+
+
+def get_pdf_response_unless_base64_exists(s3_client: S3Client, source_ref: str, pdf_base64_s3_ref: str):
+    """Return the S3 response of the PDF, or None without requesting it when its base64 intermediate file already exists."""
+    if s3_client.object_exists(pdf_base64_s3_ref):
+        return None
+    return s3_client.get_object_response_from_s3(source_ref)
+
+
+def get_blocks_cache_s3_ref(source_ref: str, pdf_bytes: bytes, page_num: int, use_textract_only: bool):
+    """Return the S3 reference of the cached blocks of a PDF page, addressed by the PDF content and how its blocks are extracted."""
+    bucket, _ = S3Client.bucket_key_from_s3_uri(source_ref)
+    pdf_hash = hashlib.sha256(pdf_bytes).hexdigest()
+    extraction_mode = 'textract' if use_textract_only else 'auto'
+    return f's3://{bucket}/{general.BLOCKS_CACHE_FOLDER}/{general.VERSION}/{pdf_hash}/{page_num}_{extraction_mode}_blocks.json'
+
+
+def get_cached_pdf_blocks(s3_client: S3Client, blocks_cache_s3_ref: str):
+    """Return the cached blocks of a PDF page and whether it is a native PDF page, or None if they could not be read or parsed."""
+    try:
+        cached_pdf_blocks = orjson.loads(s3_client.get_object_bytes_from_s3(blocks_cache_s3_ref))
+        return cached_pdf_blocks['Blocks'], cached_pdf_blocks['IsNativePDF']
+    except (ClientError, ValueError, KeyError, TypeError) as e:
+        # a missing, truncated or differently shaped cache object is a cache miss; the blocks are extracted again and rewritten
+        print(f'No cached blocks read from {blocks_cache_s3_ref}: {e}')
+        return None
+
+
+def cache_pdf_blocks(s3_client: S3Client, blocks_cache_s3_ref: str, pdf_blocks: list, is_native_pdf: bool):
+    """Write the blocks of a PDF page to the blocks cache, only logging failures as the cache is an optimization."""
+    try:
+        s3_client.write_content(s3_path=blocks_cache_s3_ref, content=orjson.dumps({'IsNativePDF': is_native_pdf, 'Blocks': pdf_blocks}, default=JSONHandler))
+    except Exception:
+        # the cache is only an optimization, so a failed write is logged instead of failing the task
+        print(f'Failed to cache blocks to {blocks_cache_s3_ref}')
+        traceback.print_exc()
+
+
 def get_temp_folder_bucket_key_from_s3_uri(s3_ref: str, job_id: str):
     """Get the temporary file folder name from an S3 reference and return the folder name and its bucket."""
     bucket, _ = S3Client.bucket_key_from_s3_uri(s3_ref)
@@ -111,12 +178,14 @@ def plumber_line_to_blocks(page: int, plumber_line: List[dict], block_index: int
         block_index += 1
         block_word = Block(page, 'WORD', plumber_word['text'], block_index,
                            get_geometry_from_plumber_word(plumber_word, page_width, page_height), block_line.blockIndex)
-        block_line.extend_geometry(block_word.Geometry)
 
         block_word_list.append(block_word)
 
         ids.append(block_word.Id)
 
+    if block_word_list:
+        line_bounding_box = union_bounding_boxes([block_word.Geometry.BoundingBox for block_word in block_word_list])
+        block_line.Geometry = Geometry(line_bounding_box.Width, line_bounding_box.Height, line_bounding_box.Left, line_bounding_box.Top)
     block_line.Relationships.append(Relationship(ids, 'CHILD'))
     ret_blocks = [block_line]
     ret_blocks.extend(block_word_list)
@@ -220,15 +289,18 @@ def blocks_from_scanned_pdf(pdf_bytes_io: io.BytesIO, page_number: int, textract
     try:
         result = textract_client.detect_document_text(page_byte_value)
         textract_blocks = result["Blocks"]
-        textract_line_blocks = [block for block in textract_blocks if block['BlockType'] == 'LINE']
-        textract_word_blocks = [block for block in textract_blocks if block['BlockType'] == 'WORD']
+        # partition the textract blocks in a single pass, keeping word blocks by id to quickly retrieve them
+        textract_line_blocks = []
+        idToWordBlock = {}
+        for textract_block in textract_blocks:
+            if textract_block['BlockType'] == 'LINE':
+                textract_line_blocks.append(textract_block)
+            elif textract_block['BlockType'] == 'WORD':
+                idToWordBlock[textract_block['Id']] = textract_block
         print("== Textract blocks ==")
         print(f"number of total textract blocks = {len(textract_blocks)}")
         print(f"number of textract line blocks = {len(textract_line_blocks)}")
-        print(f"number of textract word blocks = {len(textract_word_blocks)}")
-
-        # use to quickly retrieve word blocks
-        idToWordBlock = {b['Id']: b for b in textract_blocks if b['BlockType'] == 'WORD'}
+        print(f"number of textract word blocks = {len(idToWordBlock)}")
 
         blocks = []
         # for each textract line block, create a line block, then create the word blocks by looping through its Relationships,
@@ -247,13 +319,10 @@ def blocks_from_scanned_pdf(pdf_bytes_io: io.BytesIO, page_number: int, textract
                     word_block = textract_block_to_block(page_number, textract_word_block, index, line_index)
                     blocks.append(word_block)
 
-        line_blocks = [block for block in blocks if block.BlockType == 'LINE']
-        word_blocks = [block for block in blocks if block.BlockType == 'WORD']
-
         print(" == Blocks after conversion== ")
         print(f"number of after conversion blocks = {len(blocks)}")
-        print(f"number of after conversion line blocks = {len(line_blocks)}")
-        print(f"number of after conversion word blocks = {len(word_blocks)}")
+        print(f"number of after conversion line blocks = {len(textract_line_blocks)}")
+        print(f"number of after conversion word blocks = {len(blocks) - len(textract_line_blocks)}")
         return blocks
     except Exception as e:
         print(f"Failed to analyze page {page_number} due to {e}")
@@ -318,7 +387,7 @@ def lambda_handler(event, context):
 
     """
     # Event received
-    print("Received event: " + json.dumps(event, indent=2))
+    print("Received event: " + orjson.dumps(event, option=orjson.OPT_INDENT_2).decode("utf-8"))
     job_arn = event['labelingJobArn']
     job_id = job_arn.split('/')[-1]
     print(f'labeling job id = {job_id}')
@@ -340,59 +409,102 @@ def lambda_handler(event, context):
     use_textract_only = metadata.get("use-textract-only", False)
     metadata["use-textract-only"] = "true" if use_textract_only else "false"
 
-    s3_client = S3Client()
-    textract_client = TextractClient()
+    s3_client = get_s3_client()
 
-    pdf_s3_resp = s3_client.get_object_response_from_s3(source_ref)
-    pdf_bytes = pdf_s3_resp['Body'].read()
-    print(f"pdf_bytes length = {len(pdf_bytes)}")
-    pdf_page_base64 = base64.b64encode(pdf_bytes)
-    do_ocr = True
-
-    # Decide whether to extract blocks from input jobs' blocks or from PDF file
     primary_annotation_ref = data_obj.get("primary-annotation-ref")
-    if primary_annotation_ref:
-        do_ocr = False
-        primary_annotation_s3_resp = s3_client.get_object_response_from_s3(primary_annotation_ref)
-
-        # use pdf blocks from most recently modified annotation file
-        secondary_annotation_ref = data_obj.get("secondary-annotation-ref")
-        if secondary_annotation_ref:
-            secondary_annotation_s3_resp = s3_client.get_object_response_from_s3(secondary_annotation_ref)
-
-            primary_annotation_date = primary_annotation_s3_resp["LastModified"]
-            secondary_annotation_date = secondary_annotation_s3_resp["LastModified"]
+    secondary_annotation_ref = data_obj.get("secondary-annotation-ref")
+
+    pdf_base64_s3_ref = get_pdf_temp_file_s3_ref(source_ref, page_num, job_id, 'base64')
+
+    with ThreadPoolExecutor(max_workers=general.PRE_HUMAN_TASK_MAX_WORKERS) as executor:
+        # Fetch the PDF and the annotation files concurrently. A page surfaced again within the same labeling job already has
+        # its base64 copy, so when its blocks come from an annotation file the PDF is only requested if that copy is missing.
+        pdf_s3_resp_future = executor.submit(get_pdf_response_unless_base64_exists, s3_client, source_ref, pdf_base64_s3_ref) \
+            if primary_annotation_ref else executor.submit(s3_client.get_object_response_from_s3, source_ref)
+        primary_annotation_s3_resp_future = executor.submit(s3_client.get_object_response_from_s3, primary_annotation_ref) \
+            if primary_annotation_ref else None
+        secondary_annotation_s3_resp_future = executor.submit(s3_client.get_object_response_from_s3, secondary_annotation_ref) \
+            if primary_annotation_ref and secondary_annotation_ref else None
+
+        do_ocr = True
+
+        # Decide whether to extract blocks from input jobs' blocks or from PDF file
+        if primary_annotation_ref:
+            do_ocr = False
+            primary_annotation_s3_resp = primary_annotation_s3_resp_future.result()
+
+            # use pdf blocks from most recently modified annotation file
+            if secondary_annotation_ref:
+                secondary_annotation_s3_resp = secondary_annotation_s3_resp_future.result()
+
+                primary_annotation_date = primary_annotation_s3_resp["LastModified"]
+                secondary_annotation_date = secondary_annotation_s3_resp["LastModified"]
+
+                # Both objects are requested concurrently to compare their LastModified headers; the body of the older one is
+                # closed unread so that only the newer annotation file is downloaded
+                if primary_annotation_date >= secondary_annotation_date:
+                    secondary_annotation_s3_resp["Body"].close()
+                    annotation_bytes = primary_annotation_s3_resp["Body"].read()
+                else:
+                    primary_annotation_s3_resp["Body"].close()
+                    annotation_bytes = secondary_annotation_s3_resp["Body"].read()
 
-            if primary_annotation_date >= secondary_annotation_date:
-                annotation_bytes = primary_annotation_s3_resp["Body"].read()
+                    # set most recent annotation file as primary annotation reference
+                    data_obj["primary-annotation-ref"], data_obj["secondary-annotation-ref"] = \
+                        data_obj["secondary-annotation-ref"], data_obj["primary-annotation-ref"]
             else:
-                annotation_bytes = secondary_annotation_s3_resp["Body"].read()
-
-                # set most recent annotation file as primary annotation reference
-                data_obj["primary-annotation-ref"], data_obj["secondary-annotation-ref"] = \
-                    data_obj["secondary-annotation-ref"], data_obj["primary-annotation-ref"]
-        else:
-            annotation_bytes = primary_annotation_s3_resp["Body"].read()
+                annotation_bytes = primary_annotation_s3_resp["Body"].read()
 
-        annotation_dict = json.loads(annotation_bytes.decode('utf-8'))
-        annotation_obj = SemiStructuredAnnotation(**annotation_dict)
+            annotation_dict = orjson.loads(annotation_bytes)
+            annotation_obj = SemiStructuredAnnotation(**annotation_dict)
 
-        if annotation_obj.Blocks:
-            pdf_blocks = annotation_obj.Blocks
-            is_native_pdf = annotation_obj.DocumentType == SemiStructuredDocumentType.NativePDF.value
+            if annotation_obj.Blocks:
+                pdf_blocks = annotation_obj.Blocks
+                is_native_pdf = annotation_obj.DocumentType == SemiStructuredDocumentType.NativePDF.value
+            else:
+                print('Remove annotation references as no extracted blocks are found in the latest annotation file.')
+                data_obj.pop("primary-annotation-ref", None)
+                data_obj.pop("secondary-annotation-ref", None)
+                do_ocr = True
+
+        pdf_s3_resp = pdf_s3_resp_future.result()
+        pdf_base64_exists = pdf_s3_resp is None
+        if pdf_base64_exists and do_ocr:
+            # the annotation file has no blocks, so the PDF is needed to extract them after all
+            pdf_s3_resp = s3_client.get_object_response_from_s3(source_ref)
+        if pdf_s3_resp:
+            pdf_bytes = pdf_s3_resp['Body'].read()
+            print(f"pdf_bytes length = {len(pdf_bytes)}")
+
+        if pdf_base64_exists:
+            print(f'Reusing the existing base64 intermediate file {pdf_base64_s3_ref}.')
+            pdf_base64_s3_ref_future = None
         else:
-            print('Remove annotation references as no extracted blocks are found in the latest annotation file.')
-            data_obj.pop("primary-annotation-ref", None)
-            data_obj.pop("secondary-annotation-ref", None)
-            do_ocr = True
-
-    if do_ocr:
-        print(f'Attempting OCR with use-textract-only: {use_textract_only}')
-        pdf_blocks, is_native_pdf = get_pdf_blocks(pdf_bytes, page_num, use_textract_only, source_ref=source_ref, textract_client=textract_client)
-
-    # create intermediate files and write to S3
-    pdf_base64_s3_ref = output_pdf_temp_file_to_s3(s3_client, source_ref, pdf_page_base64, page_num, job_id)
-    pdf_block_s3_ref = output_pdf_temp_file_to_s3(s3_client, source_ref, pdf_blocks, page_num, job_id)
+            # The base64 intermediate file is written while the blocks are extracted. Only the pending upload references the
+            # base64 copy of the PDF, so it is freed as soon as the upload completes instead of living until the handler returns.
+            pdf_base64_s3_ref_future = executor.submit(output_pdf_base64_temp_file_to_s3, s3_client, source_ref, base64.b64encode(pdf_bytes),
+                                                       page_num, job_id)
+
+        if do_ocr:
+            # Reuse the blocks of a page already processed by this or another job
+            blocks_cache_s3_ref = get_blocks_cache_s3_ref(source_ref, pdf_bytes, page_num, use_textract_only)
+            cached_pdf_blocks = get_cached_pdf_blocks(s3_client, blocks_cache_s3_ref)
+            if cached_pdf_blocks:
+                print(f'Using cached blocks from {blocks_cache_s3_ref}')
+                pdf_blocks, is_native_pdf = cached_pdf_blocks
+            else:
+                print(f'Attempting OCR with use-textract-only: {use_textract_only}')
+                pdf_blocks, is_native_pdf = get_pdf_blocks(pdf_bytes, page_num, use_textract_only, source_ref=source_ref,
+                                                           textract_client=get_textract_client())
+                # Failed extractions return no blocks and are not cached, so that they are retried. The executor's shutdown at the
+                # end of this block waits for the write, as the execution environment may be frozen once the handler returns.
+                if pdf_blocks:
+                    executor.submit(cache_pdf_blocks, s3_client, blocks_cache_s3_ref, pdf_blocks, is_native_pdf)
+
+        # create intermediate files and write to S3
+        pdf_block_s3_ref = output_pdf_blocks_temp_file_to_s3(s3_client, source_ref, pdf_blocks, page_num, job_id)
+        if pdf_base64_s3_ref_future:
+            pdf_base64_s3_ref_future.result()
 
     task_object = {
         "pdfBase64S3Ref": pdf_base64_s3_ref,
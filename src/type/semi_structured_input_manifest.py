@@ -3,18 +3,27 @@
 
 """Contains input manifest JSON data types."""
 
-from typing import Optional
+from typing import Optional, TypedDict
 
+# The keys are hyphenated, so the type has to be declared with the functional syntax.
+SemiStructuredInputManifestObject = TypedDict('SemiStructuredInputManifestObject', {
+    'source-ref': str,
+    'page': str,
+    'metadata': dict,
+    'annotator-metadata': Optional[dict],
+    'primary-annotation-ref': Optional[str],
+    'secondary-annotation-ref': Optional[str]
+})
 
-class SemiStructuredInputManifestObject:
-    """Class for input manifest JSON object."""
 
-    def __init__(self, source_ref: str = "", page: str = "1", metadata: dict = {}, annotator_metadata: Optional[dict] = None,
-                 primary_annotation_ref: Optional[str] = None, secondary_annotation_ref: Optional[str] = None):
-        """Init."""
-        setattr(self, "source-ref", source_ref)
-        self.page = page
-        self.metadata = metadata
-        setattr(self, "annotator-metadata", annotator_metadata)
-        setattr(self, "primary-annotation-ref", primary_annotation_ref)
-        setattr(self, "secondary-annotation-ref", secondary_annotation_ref)
+def create_input_manifest_object(source_ref: str = "", page: str = "1", metadata: Optional[dict] = None, annotator_metadata: Optional[dict] = None,
+                                 primary_annotation_ref: Optional[str] = None, secondary_annotation_ref: Optional[str] = None) -> SemiStructuredInputManifestObject:
+    """Create an input manifest JSON object as a plain dictionary, ready to be serialized."""
+    return {
+        'source-ref': source_ref,
+        'page': page,
+        'metadata': metadata if metadata is not None else {},
+        'annotator-metadata': annotator_metadata,
+        'primary-annotation-ref': primary_annotation_ref,
+        'secondary-annotation-ref': secondary_annotation_ref
+    }
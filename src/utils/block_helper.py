@@ -3,16 +3,28 @@
 
 """Block helper class."""
 from typing import List, Union
-import uuid
-import copy
+import random
+
+# Seeded from os.urandom; block ids only need to be unique, not unpredictable.
+_random = random.Random()
+# Version 4 / RFC 4122 variant bits of a UUID.
+_UUID4_CLEAR_MASK = ~(0xf000 << 64 | 0xc000 << 48)
+_UUID4_SET_BITS = 0x4000 << 64 | 0x8000 << 48
+
+
+def get_slots(cls: type) -> tuple:
+    """Return the names of the slots declared by a class and its bases, base class slots first."""
+    return tuple(slot for klass in reversed(cls.__mro__) for slot in getattr(klass, '__slots__', ()))
 
 
 class DictionaryClass:
     """Class to define an object as a dictionary."""
 
+    __slots__ = ()
+
     def __str__(self):
         """Return a string representation of the object as a dictionary."""
-        return str(self.__dict__)
+        return str(self.reprJSON())
 
     def __repr__(self):
         """Return a string representation of the object."""
@@ -20,7 +32,13 @@ class DictionaryClass:
 
     def reprJSON(self):
         """Return dictionary representation of the object."""
-        return self.__dict__
+        return {slot: getattr(self, slot) for slot in get_slots(type(self))}
+
+
+def generate_block_id() -> str:
+    """Return a random version 4 UUID string, cheaper to generate than str(uuid.uuid4())."""
+    hex_id = f'{_random.getrandbits(128) & _UUID4_CLEAR_MASK | _UUID4_SET_BITS:032x}'
+    return f'{hex_id[:8]}-{hex_id[8:12]}-{hex_id[12:16]}-{hex_id[16:20]}-{hex_id[20:]}'
 
 
 def JSONHandler(Obj):
@@ -34,6 +52,8 @@ def JSONHandler(Obj):
 class BoundingBox(DictionaryClass):
     """Class to define a Semi-Structured BoundingBox object."""
 
+    __slots__ = ('Width', 'Top', 'Left', 'Height')
+
     def __init__(self, width: int, height: int, left: int, top: int):
         self.Width = width
         self.Top = top
@@ -42,25 +62,36 @@ class BoundingBox(DictionaryClass):
 
     def extend_bounding_box(self, bounding_box: 'BoundingBox'):
         """Extend the BoundingBox object's dimensions to another BoundingBox object."""
-        selfRight = self.Left + self.Width
-        selfBottom = self.Top + self.Height
-        bbRight = bounding_box.Left + bounding_box.Width
-        bbBottom = bounding_box.Top + bounding_box.Height
-        self.Width = abs(min(self.Left, bounding_box.Left) - max(selfRight, bbRight))
-        self.Height = abs(min(self.Top, bounding_box.Top) - max(selfBottom, bbBottom))
-        if self.Left > bounding_box.Left:
-            self.Left = bounding_box.Left
-        if self.Top > bounding_box.Top:
-            self.Top = bounding_box.Top
+        union = union_bounding_boxes([self, bounding_box])
+        self.Width, self.Top, self.Left, self.Height = union.Width, union.Top, union.Left, union.Height
+
+    def reprJSON(self):
+        """Return dictionary representation of the object."""
+        return {'Width': self.Width, 'Top': self.Top, 'Left': self.Left, 'Height': self.Height}
+
+
+def union_bounding_boxes(bounding_boxes: List[BoundingBox]) -> BoundingBox:
+    """Return the smallest BoundingBox enclosing a non-empty list of BoundingBox objects."""
+    left = min(bounding_box.Left for bounding_box in bounding_boxes)
+    top = min(bounding_box.Top for bounding_box in bounding_boxes)
+    right = max(bounding_box.Left + bounding_box.Width for bounding_box in bounding_boxes)
+    bottom = max(bounding_box.Top + bounding_box.Height for bounding_box in bounding_boxes)
+    return BoundingBox(abs(left - right), abs(top - bottom), left, top)
 
 
 class Point(DictionaryClass):
     """Class to define a Semi-Structured Point object."""
 
+    __slots__ = ('X', 'Y')
+
     def __init__(self, x: int, y: int):
         self.X = x
         self.Y = y
 
+    def reprJSON(self):
+        """Return dictionary representation of the object."""
+        return {'X': self.X, 'Y': self.Y}
+
 
 def get_points(width: int, height: int, left: int, top: int):
     """Return a list of Point objects from a boundary."""
@@ -69,40 +100,64 @@ def get_points(width: int, height: int, left: int, top: int):
 
 def extend_polygon(polygon1: List[Point], polygon2: List[Point]):
     """Return a polygon extended from another polygon."""
-    bounding_box_1 = BoundingBox(polygon1[2].X - polygon1[0].X, polygon1[2].Y - polygon1[0].Y, polygon1[0].X, polygon1[0].Y)
-    bounding_box_2 = BoundingBox(polygon2[2].X - polygon2[0].X, polygon2[2].Y - polygon2[0].Y, polygon2[0].X, polygon2[0].Y)
-    bounding_box_1.extend_bounding_box(bounding_box_2)
-
-    return get_points(bounding_box_1.Width, bounding_box_1.Height, bounding_box_1.Left, bounding_box_1.Top)
+    bounding_box = union_bounding_boxes([
+        BoundingBox(polygon1[2].X - polygon1[0].X, polygon1[2].Y - polygon1[0].Y, polygon1[0].X, polygon1[0].Y),
+        BoundingBox(polygon2[2].X - polygon2[0].X, polygon2[2].Y - polygon2[0].Y, polygon2[0].X, polygon2[0].Y)
+    ])
+    return get_points(bounding_box.Width, bounding_box.Height, bounding_box.Left, bounding_box.Top)
 
 
 class Geometry(DictionaryClass):
     """Class to define an Semi-Structured Block object."""
 
+    __slots__ = ('BoundingBox',)
+
     def __init__(self, width: int, height: int, left: int, top: int):
         self.BoundingBox = BoundingBox(width, height, left, top)
-        self.Polygon = get_points(width, height, left, top)
+
+    @property
+    def Polygon(self) -> List[Point]:
+        """Return the Polygon of the Geometry object's BoundingBox."""
+        bounding_box = self.BoundingBox
+        return get_points(bounding_box.Width, bounding_box.Height, bounding_box.Left, bounding_box.Top)
 
     def extend_geometry(self, geometry: 'Geometry'):
         """Extend the Geometry object's BoundingBox to another Geometry object."""
         self.BoundingBox.extend_bounding_box(geometry.BoundingBox)
-        self.Polygon = extend_polygon(self.Polygon, geometry.Polygon)
+
+    def reprJSON(self):
+        """Return dictionary representation of the object, with the Polygon points as plain dictionaries."""
+        bounding_box = self.BoundingBox
+        left, top = bounding_box.Left, bounding_box.Top
+        right, bottom = left + bounding_box.Width, top + bounding_box.Height
+        return {
+            'BoundingBox': bounding_box,
+            'Polygon': [{'X': left, 'Y': top}, {'X': right, 'Y': top}, {'X': right, 'Y': bottom}, {'X': left, 'Y': bottom}]
+        }
 
 
 class Relationship(DictionaryClass):
     """Class to define an Semi-Structured Relationship object."""
 
+    __slots__ = ('Ids', 'Type')
+
     def __init__(self, ids: List[str], type: str):
         self.Ids = ids if ids else []
         self.Type = type
 
+    def reprJSON(self):
+        """Return dictionary representation of the object."""
+        return {'Ids': self.Ids, 'Type': self.Type}
+
 
 class Block(DictionaryClass):
     """Class to define an Semi-Structured Block object."""
 
+    __slots__ = ('BlockType', 'Id', 'Text', 'Geometry', 'Relationships', 'Page', 'parentBlockIndex', 'blockIndex')
+
     def __init__(self, page: int, block_type: str, text: str, index: int, geometry: Union[Geometry, None] = None, parent_block_index=-1):
         self.BlockType = block_type
-        self.Id = str(uuid.uuid4())
+        self.Id = generate_block_id()
         self.Text = text
         self.Geometry = geometry
         self.Relationships: List[Relationship] = []
@@ -114,6 +169,20 @@ class Block(DictionaryClass):
     def extend_geometry(self, geometry: Geometry):
         """Extend the Block object's Geometry to another Geometry object."""
         if not self.Geometry:
-            self.Geometry = copy.deepcopy(geometry)
+            bounding_box = geometry.BoundingBox
+            self.Geometry = Geometry(bounding_box.Width, bounding_box.Height, bounding_box.Left, bounding_box.Top)
         else:
             self.Geometry.extend_geometry(geometry)
+
+    def reprJSON(self):
+        """Return dictionary representation of the object."""
+        return {
+            'BlockType': self.BlockType,
+            'Id': self.Id,
+            'Text': self.Text,
+            'Geometry': self.Geometry,
+            'Relationships': self.Relationships,
+            'Page': self.Page,
+            'parentBlockIndex': self.parentBlockIndex,
+            'blockIndex': self.blockIndex
+        }
@@ -23,6 +23,20 @@ def get_pdf_page_bytes(pdf_bytes_io: io.BytesIO, page_number: int) -> bytes:
     return page_bytes
 
 
+def get_pdf_page_count_from_stream(stream) -> int:
+    """Get the number of pages of a PDF from the /Count of its page tree root, only reading the objects needed to find it."""
+    pdf_file_reader = pdf.PdfFileReader(stream=stream, strict=False)
+    if pdf_file_reader.isEncrypted:
+        return pdf_file_reader.getNumPages()
+    return int(pdf_file_reader.trailer['/Root']['/Pages']['/Count'])
+
+
+def get_pdf_page_count(path_to_pdf: str) -> int:
+    """Get the number of pages of a local PDF file without parsing the page contents."""
+    with open(path_to_pdf, 'rb') as pdf_file:
+        return get_pdf_page_count_from_stream(pdf_file)
+
+
 def get_pdf_bytes(path_to_pdf: str) -> bytes:
     """Get bytes for local PDF file."""
     pdf_file = open(path_to_pdf, 'rb')
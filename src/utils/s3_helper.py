@@ -5,26 +5,139 @@
 import io
 import mimetypes
 import os
-import json
-from typing import Dict, List, Tuple, Union
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterable, List, Optional, Tuple, Union
 from urllib.parse import urlparse
 
 import boto3
+from boto3.s3.transfer import TransferConfig
+import orjson
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
+from constants import general
+
+# Content types of the file types shipped in the UI template, to avoid a mimetypes lookup per uploaded file.
+CONTENT_TYPES_BY_EXTENSION = {
+    '.html': 'text/html',
+    '.js': 'application/javascript',
+    '.css': 'text/css',
+    '.json': 'application/json',
+    '.svg': 'image/svg+xml',
+    '.png': 'image/png',
+    '.ico': 'image/vnd.microsoft.icon',
+    '.woff2': 'font/woff2'
+}
+
+# Shared by every managed transfer so they all reuse the same bounded settings instead of building defaults per call.
+S3_TRANSFER_CONFIG = TransferConfig(multipart_threshold=general.S3_MULTIPART_THRESHOLD_BYTES, max_concurrency=general.S3_TRANSFER_MAX_CONCURRENCY)
+
+
+def get_boto3_client_config() -> Config:
+    """Return the botocore config for clients used from the S3 transfer thread pools."""
+    return Config(
+        max_pool_connections=general.S3_MAX_POOL_CONNECTIONS,
+        retries={'mode': general.BOTO3_RETRY_MODE, 'max_attempts': general.BOTO3_MAX_ATTEMPTS}
+    )
+
+
+def _iter_files(local_path: str, relative_prefix: str = ''):
+    """Recursively yield the path and the '/'-separated path relative to local_path of every file in a local directory."""
+    with os.scandir(local_path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from _iter_files(entry.path, f'{relative_prefix}{entry.name}/')
+            elif entry.is_file():
+                yield entry.path, f'{relative_prefix}{entry.name}'
+
+
+class S3ObjectRangeReader(object):
+    """Read-only, seekable file object over an S3 object which only fetches the byte ranges that are read."""
+
+    def __init__(self, s3_client, bucket: str, key: str, block_size: int = general.S3_RANGE_READ_BLOCK_SIZE_BYTES):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.block_size = block_size
+        self.size = s3_client.head_object(Bucket=bucket, Key=key)['ContentLength']
+        self._position = 0
+        self._blocks: Dict[int, bytes] = {}
+
+    def seekable(self) -> bool:
+        """Return True as the reader supports random access."""
+        return True
+
+    def tell(self) -> int:
+        """Return the current position in the object."""
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """Move the current position in the object."""
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f'Invalid whence ({whence})')
+        if position < 0:
+            raise ValueError(f'Negative seek position {position}')
+        self._position = position
+        return self._position
+
+    def read(self, size: int = -1) -> bytes:
+        """Read up to size bytes from the current position, fetching missing blocks with ranged GETs."""
+        end = self.size if size is None or size < 0 else min(self.size, self._position + size)
+        if self._position >= end:
+            return b''
+        first_block = self._position // self.block_size
+        last_block = (end - 1) // self.block_size
+        self._fetch_blocks(first_block, last_block)
+
+        data = b''.join(self._blocks[block] for block in range(first_block, last_block + 1))
+        start = self._position - first_block * self.block_size
+        content = data[start:start + end - self._position]
+        self._position = end
+        return content
+
+    def _fetch_blocks(self, first_block: int, last_block: int):
+        """Fetch the missing blocks in [first_block, last_block], one ranged GET per contiguous run of missing blocks."""
+        block = first_block
+        while block <= last_block:
+            if block in self._blocks:
+                block += 1
+                continue
+            run_end = block
+            while run_end + 1 <= last_block and run_end + 1 not in self._blocks:
+                run_end += 1
+            range_start = block * self.block_size
+            range_end = min(self.size, (run_end + 1) * self.block_size) - 1
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self.key, Range=f'bytes={range_start}-{range_end}')
+            data = response['Body'].read()
+            for i in range(block, run_end + 1):
+                offset = (i - block) * self.block_size
+                self._blocks[i] = data[offset:offset + self.block_size]
+            block = run_end + 1
+
 
 class S3Client(object):
     """Helper Class for S3 operations."""
 
-    def __init__(self):
+    def __init__(self, session: Optional[boto3.Session] = None, config: Optional[Config] = None):
         """
         Initialize the S3 client.
+
+        :param session: boto3 session to create the clients from. Defaults to a new session in AWS_REGION.
+        :param config: botocore config shared with the caller's other clients. Defaults to get_boto3_client_config().
         :return:
 
         """
-        session = boto3.Session(region_name=os.environ.get('AWS_REGION'))
-        self.s3 = session.resource('s3')
-        self.s3_client = session.client('s3')
+        session = session if session else boto3.Session(region_name=os.environ.get('AWS_REGION'))
+        config = config if config else get_boto3_client_config()
+        self.s3 = session.resource('s3', config=config)
+        self.s3_client = session.client('s3', config=config)
 
     def validate_bucket_exists(self, s3_bucket_name: str):
         """Run a boto3 API to check if an S3 bucket exists."""
@@ -35,10 +148,29 @@ class S3Client(object):
         bucket, path = S3Client.bucket_key_from_s3_uri(s3_url)
         return self.s3_client.get_object(Bucket=bucket, Key=path)
 
+    def object_exists(self, s3_url: str) -> bool:
+        """Return whether an object exists at the S3 url, checked with a HEAD request instead of downloading it."""
+        bucket, path = S3Client.bucket_key_from_s3_uri(s3_url)
+        try:
+            self.s3_client.head_object(Bucket=bucket, Key=path)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        return True
+
+    def open_object(self, bucket: str, key: str) -> S3ObjectRangeReader:
+        """Return a seekable file object over an S3 object which reads it with ranged GETs."""
+        return S3ObjectRangeReader(self.s3_client, bucket, key)
+
+    def get_object_bytes_from_s3(self, s3_url: str) -> bytes:
+        """Return the raw object content retrieved from S3 url, without decoding it."""
+        print(f"Retrieving data from {s3_url}.")
+        return self.get_object_response_from_s3(s3_url).get('Body').read()
+
     def get_object_content_from_s3(self, s3_url: str):
         """Return object content retrieved from S3 url."""
-        print(f"Retrieving data from {s3_url}.")
-        return self.get_object_response_from_s3(s3_url).get('Body').read().decode('utf-8')
+        return self.get_object_bytes_from_s3(s3_url).decode('utf-8')
 
     def write_content(self, s3_path: str, content: Union[str, bytes]):
         """
@@ -50,7 +182,11 @@ class S3Client(object):
         content_bytes = content if type(content) == bytes else content.encode('utf-8')
         bucket, key = S3Client.bucket_key_from_s3_uri(s3_path)
 
-        self.s3_client.upload_fileobj(io.BytesIO(content_bytes), bucket, key)
+        # A single PUT avoids the managed transfer overhead for the small files we usually write.
+        if len(content_bytes) > general.S3_MULTIPART_THRESHOLD_BYTES:
+            self.s3_client.upload_fileobj(io.BytesIO(content_bytes), bucket, key, Config=S3_TRANSFER_CONFIG)
+        else:
+            self.s3_client.put_object(Bucket=bucket, Key=key, Body=content_bytes)
         print(f'Uploaded data to {s3_path}')
 
     def copy_file(self, old_s3_path: str, new_s3_path: str):
@@ -72,69 +208,112 @@ class S3Client(object):
         return True
 
     def upload_file(self, local_path: str, bucket: str, s3_key: str, extra_args):
-        """Upload a local file to S3."""
+        """Upload a local file to S3, logging and re-raising any failure."""
         try:
-            self.s3_client.upload_file(local_path, bucket, s3_key, ExtraArgs=extra_args)
+            self.s3_client.upload_file(local_path, bucket, s3_key, ExtraArgs=extra_args, Config=S3_TRANSFER_CONFIG)
         except Exception as e:
-            print(e)
+            print(f'Failed to upload {local_path} to s3://{bucket}/{s3_key}: {e}')
+            raise
 
     def upload_directory(self, local_dir_path: str, bucket_name: str, s3_path_prefix: str):
-        """Upload a directory to S3."""
-        for local_path, s3_key, extra_args in self._collect_s3_upload_file_arguments(local_dir_path, s3_path_prefix):
-            self.upload_file(local_path=local_path, bucket=bucket_name, s3_key=s3_key, extra_args=extra_args)
+        """Upload a directory to S3, sending the files concurrently."""
+        with ThreadPoolExecutor(max_workers=general.S3_TRANSFER_MAX_WORKERS) as executor:
+            futures = [
+                executor.submit(self.upload_file, local_path=local_path, bucket=bucket_name, s3_key=s3_key, extra_args=extra_args)
+                for local_path, s3_key, extra_args in self._collect_s3_upload_file_arguments(local_dir_path, s3_path_prefix)
+            ]
+            for future in as_completed(futures):
+                future.result()
 
     def download_file(self, local_path: str, bucket: str, s3_key: str):
         """Download a file from S3."""
-        s3_bucket = self.s3.Bucket(bucket)
-        s3_bucket.download_file(s3_key, local_path)
+        self.s3_client.download_file(bucket, s3_key, local_path, Config=S3_TRANSFER_CONFIG)
 
     def download_directory(self, local_dir_path: str, bucket_name: str, s3_path_prefix: str):
-        """Download a directory from S3."""
+        """Download a directory from S3, fetching the files concurrently."""
         s3_download_file_args = self._get_s3_download_file_args(
-            s3_objects=self.get_objects_from_s3(bucket=bucket_name, filter_prefix=s3_path_prefix),
+            s3_keys=self.get_keys_from_s3(bucket=bucket_name, filter_prefix=s3_path_prefix, suffix='.pdf'),
             local_dir=local_dir_path
         )
-        for download_source_key, download_target in s3_download_file_args:
-            self.download_file(local_path=download_target, bucket=bucket_name, s3_key=download_source_key)
+        with ThreadPoolExecutor(max_workers=general.S3_TRANSFER_MAX_WORKERS) as executor:
+            futures = [
+                executor.submit(self.download_file, local_path=download_target, bucket=bucket_name, s3_key=download_source_key)
+                for download_source_key, download_target in s3_download_file_args
+            ]
+            for future in futures:
+                future.result()
 
-    def get_objects_from_s3(self, bucket: str, filter_prefix: str = "") -> List:
-        """Get objects from S3 filtered by a given prefix."""
-        s3_bucket = self.s3.Bucket(bucket)
-        return s3_bucket.objects.filter(Prefix=filter_prefix)
+    def get_keys_from_s3(self, bucket: str, filter_prefix: str = "", suffix: str = "") -> List[str]:
+        """
+        Get the keys of the objects in S3 under a given prefix and ending with suffix, listing 1000 keys per request.
 
-    def write_jsonl(self, s3_path: str, rows: List[Dict]):
+        The objects directly under the prefix are listed first, then every "folder" below it is listed concurrently.
         """
-        Write the passed in list of dictionaries to the given local or s3 path as JSONL.
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        keys = []
+        sub_prefixes = []
+        for page in paginator.paginate(Bucket=bucket, Prefix=filter_prefix, Delimiter='/', PaginationConfig={'PageSize': 1000}):
+            keys.extend(obj['Key'] for obj in page.get('Contents', []) if obj['Key'].endswith(suffix))
+            sub_prefixes.extend(common_prefix['Prefix'] for common_prefix in page.get('CommonPrefixes', []))
+
+        if sub_prefixes:
+            with ThreadPoolExecutor(max_workers=general.S3_LIST_MAX_WORKERS) as executor:
+                for sub_prefix_keys in executor.map(lambda sub_prefix: self._list_keys(paginator, bucket, sub_prefix, suffix), sub_prefixes):
+                    keys.extend(sub_prefix_keys)
+        return keys
+
+    def write_jsonl(self, s3_path: str, rows: Iterable[Dict]):
+        """
+        Write the passed in dictionaries to the given local or s3 path as JSONL.
+
+        The rows are consumed one at a time and spooled to disk once they exceed general.JSONL_SPOOL_MAX_SIZE_BYTES.
 
         :param s3_path: Path to write to. Accepts local filesystem and S3 paths
-        :param rows: List of dictionaries to encode as JSONL
+        :param rows: Iterable of dictionaries to encode as JSONL, e.g. a generator
         :return:
         """
-        content = ''.join([f'{json.dumps(row)}\n' for row in rows])
-        self.write_content(content=content, s3_path=s3_path)
+        bucket, key = S3Client.bucket_key_from_s3_uri(s3_path)
+        with tempfile.SpooledTemporaryFile(max_size=general.JSONL_SPOOL_MAX_SIZE_BYTES) as content_file:
+            for row in rows:
+                content_file.write(orjson.dumps(row))
+                content_file.write(b'\n')
+            content_size = content_file.tell()
+            content_file.seek(0)
+
+            # Same rule as write_content: manifests are usually small enough for a single PUT.
+            if content_size > general.S3_MULTIPART_THRESHOLD_BYTES:
+                self.s3_client.upload_fileobj(content_file, bucket, key, Config=S3_TRANSFER_CONFIG)
+            else:
+                self.s3_client.put_object(Bucket=bucket, Key=key, Body=content_file.read())
+        print(f'Uploaded data to {s3_path}')
+
+    def _list_keys(self, paginator, bucket: str, prefix: str, suffix: str) -> List[str]:
+        """List the keys of all the objects under a prefix ending with suffix."""
+        pages = paginator.paginate(Bucket=bucket, Prefix=prefix, PaginationConfig={'PageSize': 1000})
+        return [obj['Key'] for page in pages for obj in page.get('Contents', []) if obj['Key'].endswith(suffix)]
 
     def _collect_s3_upload_file_arguments(self, local_path: str, s3_path_prefix: str):
-        """Collect the local path, S3 key to copy to, and extra S3 args for all files in a local directory."""
+        """Collect the local path, S3 key relative to s3_path_prefix, and extra S3 args for all files in a local directory."""
         upload_file_arguments = []
-        for root, dirs, files in os.walk(local_path):
-            for file in files:
-                extra_args = {}
-                content_type = mimetypes.guess_type(file)[0]
-                if content_type:
-                    extra_args['ContentType'] = content_type
-                upload_file_arguments.append((os.path.join(root, file), f'{s3_path_prefix}/{root}/{file}', extra_args))
+        for file_path, relative_key in _iter_files(local_path):
+            extra_args = {}
+            extension = os.path.splitext(relative_key)[1].lower()
+            content_type = CONTENT_TYPES_BY_EXTENSION[extension] if extension in CONTENT_TYPES_BY_EXTENSION else mimetypes.guess_type(relative_key)[0]
+            if content_type:
+                extra_args['ContentType'] = content_type
+            upload_file_arguments.append((file_path, f'{s3_path_prefix}/{relative_key}', extra_args))
         return upload_file_arguments
 
-    def _get_s3_download_file_args(self, s3_objects: list, local_dir: str):
-        """Get list of tuples of source keys, local target paths from S3 objects for all pdfs. Will also create local_dir if necessary."""
+    def _get_s3_download_file_args(self, s3_keys: List[str], local_dir: str):
+        """Get list of tuples of source keys, local target paths for all pdf keys. Will also create local_dir if necessary."""
         args = []
-        for obj in s3_objects:
-            if obj.key.endswith('.pdf'):
-                target = obj.key if local_dir is None \
-                    else os.path.join(local_dir, os.path.basename(obj.key))
+        for key in s3_keys:
+            if key.endswith('.pdf'):
+                target = key if local_dir is None \
+                    else os.path.join(local_dir, os.path.basename(key))
                 if not os.path.exists(os.path.dirname(target)):
                     os.makedirs(os.path.dirname(target))
-                args.append((obj.key, target))
+                args.append((key, target))
         return args
 
     @staticmethod
@@ -1,10 +1,10 @@
 from unittest import TestCase
 import importlib
-import shutil
 import os
-from collections import namedtuple
 import json
 
+from botocore.exceptions import ClientError
+
 from utils.s3_helper import S3Client
 from constants import general
 from type.groundtruth_annotation_ui_config import GroundTruthAnnotationUIConfig, AnnotationUITaskSchemas, NamedEntitiesAnnotationTaskConfig
@@ -29,15 +29,6 @@ def generate_schema_content(labels=general.DEFAULT_LABELS):
     ).dict())
 
 
-def generate_s3_object(value=''):
-    """Generate an S3 object with a key attribute."""
-    return namedtuple("S3Object", ['key'])(value)
-
-
-def get_all_files_in_directory(local_path: str):
-    return [f for f in os.listdir(local_path) if os.path.isfile(os.path.join(local_path, f))]
-
-
 def generate_manifest_json_list(primary_annotation_ref_none=False, secondary_annotation_ref_none=False):
     """Generate a list of manifest json objects based off of test/unit/resources/sample_output_manifest.jsonl."""
     metadata = {"pages": "1", "use-textract-only": False, "labels": ["PER", "LOC", "ORG", "FAC", "BRAND", "COMM", "TITLE:MOVIE", \
@@ -78,28 +69,14 @@ class MockS3Client(S3Client):
         print(f"local_path: {local_path}, bucket: {bucket}, s3_key: {s3_key}, extra_args: {extra_args}")
         return True
 
-    def get_objects_from_s3(self, bucket: str, filter_prefix: str = ""):
-        """Mock get_objects_from_s3 method."""
-        return [
-            generate_s3_object('file1.pdf'),
-            generate_s3_object('folder1/file2.pdf'),
-            generate_s3_object('folder1/folder2/file3.pdf'),
-        ]
-    
-    def _get_s3_download_file_args(self, s3_objects: list, local_dir: str):
-        """Mock _get_s3_download_file_args method."""
-        if not os.path.exists(local_dir):
-            os.makedirs(local_dir)
-        return [
-            ('folder1/file1.pdf', f'{local_dir}/file1.pdf'),
-            ('folder1/folder2/file2.pdf', f'{local_dir}/file2.pdf'),
-            ('folder1/folder2/folder3/file3.pdf', f'{local_dir}/file3.pdf')
-        ]
+    def get_keys_from_s3(self, bucket: str, filter_prefix: str = "", suffix: str = ""):
+        """Mock get_keys_from_s3 method."""
+        keys = [f'{filter_prefix}file3.pdf', f'{filter_prefix}file1.pdf', f'{filter_prefix}notes.txt', f'{filter_prefix}file2.pdf']
+        return [key for key in keys if key.endswith(suffix)]
 
-    def download_file(self, local_path: str, bucket: str, s3_key: str):
-        """Mock download_file method."""
-        if True in [file in local_path for file in ['file1.pdf', 'file2.pdf', 'file3.pdf']]:
-            shutil.copyfile(f'test/unit/resources/sample_documents/{os.path.basename(local_path)}', local_path)
+    def open_object(self, bucket: str, key: str):
+        """Mock open_object method."""
+        return open(f'test/unit/resources/sample_documents/{os.path.basename(key)}', 'rb')
 
     def get_object_content_from_s3(self, s3_url: str):
         """Mock get_object_content_from_s3 method."""
@@ -113,8 +90,8 @@ class MockS3Client(S3Client):
 class MockS3ClientGetNoObjectsFromS3(S3Client):
     """Mock S3 Client class."""
 
-    def get_objects_from_s3(self, bucket: str, filter_prefix: str = ""):
-        """Mock get_objects_from_s3 method."""
+    def get_keys_from_s3(self, bucket: str, filter_prefix: str = "", suffix: str = ""):
+        """Mock get_keys_from_s3 method."""
         return []
 
 
@@ -180,6 +157,12 @@ class MockSagemakerClient():
         """Mock describe_labeling_job method."""
         return self.generate_sample_describe_labeling_job_response(LabelingJobName=LabelingJobName)
 
+    def list_labeling_jobs(self, NameContains: str, MaxResults: int, NextToken: str = None):
+        """Mock list_labeling_jobs method, returning the job on a second page."""
+        if not NextToken:
+            return {'LabelingJobSummaryList': [{'LabelingJobName': f'{NameContains}-other'}], 'NextToken': 'token'}
+        return {'LabelingJobSummaryList': [{'LabelingJobName': NameContains}]}
+
 
 class MockParserArgs():
     """Mock parser.parse_args class."""
@@ -201,23 +184,14 @@ class ComprehendSSIEAnnotationToolCliTest(TestCase):
     def test_generate_schema(self):
         pass
 
-    def test_cleanup(self):
-        temp_dir_path = 'test/unit/resources/temp'
-        if not os.path.exists(temp_dir_path):
-            os.makedirs(temp_dir_path)
-        for i in range(3):
-            with open(os.path.join(temp_dir_path, f"file_{i}.txt"), 'w'):
-                pass
-        self.assertEqual(len(get_all_files_in_directory(temp_dir_path)), 3)
-
-        comprehend_ssie_annotation_tool_cli.cleanup(temp_dir_path)
-        self.assertFalse(os.path.exists(temp_dir_path))
-
     def test_validate_and_format_annotator_metadata(self):
         metadata_str = "key=key1 ,value= value1,key= key2,value=value2 "
         metadata_obj = comprehend_ssie_annotation_tool_cli.validate_and_format_annotator_metadata(metadata_str)
         self.assertEqual(metadata_obj, {"key1 ":" value1", " key2":"value2 "})
 
+        metadata_obj = comprehend_ssie_annotation_tool_cli.validate_and_format_annotator_metadata("Key=url,Value=https://example.com/?a=b")
+        self.assertEqual(metadata_obj, {"url": "https://example.com/?a=b"})
+
         metadata_str_errors = [
             "keyvalue=keyvalue1",
             "key=file1,key=file2,value=value2,value=value1",
@@ -227,6 +201,23 @@ class ComprehendSSIEAnnotationToolCliTest(TestCase):
             with self.assertRaises(comprehend_ssie_annotation_tool_cli.InvalidAnnotatorMetadataException):
                 comprehend_ssie_annotation_tool_cli.validate_and_format_annotator_metadata(metadata_str)
 
+    def test_describe_sagemaker_labeling_job_is_cached(self):
+        class MockCountingSagemakerClient(MockSagemakerClient):
+            def __init__(self):
+                self.describe_count = 0
+
+            def describe_labeling_job(self, LabelingJobName: str):
+                self.describe_count += 1
+                return super().describe_labeling_job(LabelingJobName=LabelingJobName)
+
+        sagemaker_client = MockCountingSagemakerClient()
+        comprehend_ssie_annotation_tool_cli.get_ui_template_root_from_sagemaker_job(sagemaker_client, 'job-name')
+        comprehend_ssie_annotation_tool_cli.get_output_manifest_ref_from_sagemaker_job(sagemaker_client, 'job-name')
+        self.assertEqual(sagemaker_client.describe_count, 1)
+
+        comprehend_ssie_annotation_tool_cli.get_output_manifest_ref_from_sagemaker_job(sagemaker_client, 'other-job-name')
+        self.assertEqual(sagemaker_client.describe_count, 2)
+
     def test_get_ui_template_root_from_sagemaker_job(self):
         ui_template_root = comprehend_ssie_annotation_tool_cli.get_ui_template_root_from_sagemaker_job(MockSagemakerClient(), 'job-name')
         self.assertEqual(ui_template_root, 'job-name')
@@ -241,9 +232,8 @@ class ComprehendSSIEAnnotationToolCliTest(TestCase):
 
             expected_manifest_json_list = generate_manifest_json_list(secondary_annotation_ref_none=True)
             received_manifest_json_list = comprehend_ssie_annotation_tool_cli.generate_manifest_jsons_from_previous_jobs(
-                s3_client=MockS3Client(),
-                sagemaker_client=MockSagemakerClient(),
                 primary_output_manifest_contents=primary_output_manifest_contents,
+                secondary_output_manifest_contents=None,
                 labels=general.DEFAULT_LABELS,
                 annotator_metadata=None,
                 args=MockParserArgs(blind1_labeling_job_name='mock_job_name')
@@ -252,9 +242,8 @@ class ComprehendSSIEAnnotationToolCliTest(TestCase):
 
             expected_manifest_json_list = generate_manifest_json_list()
             received_manifest_json_list = comprehend_ssie_annotation_tool_cli.generate_manifest_jsons_from_previous_jobs(
-                s3_client=MockS3Client(),
-                sagemaker_client=MockSagemakerClient(),
                 primary_output_manifest_contents=primary_output_manifest_contents,
+                secondary_output_manifest_contents=primary_output_manifest_contents,
                 labels=general.DEFAULT_LABELS,
                 annotator_metadata=None,
                 args=MockParserArgs(blind1_labeling_job_name='mock_job_name', blind2_labeling_job_name='mock_job_name')
@@ -283,9 +272,8 @@ class ComprehendSSIEAnnotationToolCliTest(TestCase):
                 }
             ]
             received_manifest_json_list = comprehend_ssie_annotation_tool_cli.generate_manifest_jsons_from_previous_jobs(
-                s3_client=MockS3Client(),
-                sagemaker_client=MockSagemakerClient(),
                 primary_output_manifest_contents=primary_output_manifest_contents,
+                secondary_output_manifest_contents=None,
                 labels=general.DEFAULT_LABELS,
                 annotator_metadata=None,
                 args=MockParserArgs(blind1_labeling_job_name='mock_job_name', only_include_expired_tasks=True)
@@ -293,10 +281,10 @@ class ComprehendSSIEAnnotationToolCliTest(TestCase):
             self.assertListEqual(expected_manifest_json_list, received_manifest_json_list)
         
 
-    def test_validate_and_download_from_input_s3_path(self):
+    def test_validate_and_list_from_input_s3_path(self):
         for input_s3_path in ['', '/', '//']:
             with self.assertRaises(ValueError) as cm:
-                comprehend_ssie_annotation_tool_cli.validate_and_download_from_input_s3_path(
+                comprehend_ssie_annotation_tool_cli.validate_and_list_from_input_s3_path(
                     s3_client=MockS3Client(),
                     ssie_documents_s3_bucket='s3://bucket',
                     args=MockParserArgs(input_s3_path=input_s3_path)
@@ -307,7 +295,7 @@ class ComprehendSSIEAnnotationToolCliTest(TestCase):
             )
 
         with self.assertRaises(ValueError) as cm:
-            comprehend_ssie_annotation_tool_cli.validate_and_download_from_input_s3_path(
+            comprehend_ssie_annotation_tool_cli.validate_and_list_from_input_s3_path(
                 s3_client=MockS3Client(),
                 ssie_documents_s3_bucket='s3://bucket',
                 args=MockParserArgs(input_s3_path='s3://different_bucket/folder/documents/', create_input_manifest_only=False)
@@ -318,21 +306,19 @@ class ComprehendSSIEAnnotationToolCliTest(TestCase):
         )
 
         with self.assertRaises(comprehend_ssie_annotation_tool_cli.NoFilesInDirectoryException):
-            comprehend_ssie_annotation_tool_cli.validate_and_download_from_input_s3_path(
+            comprehend_ssie_annotation_tool_cli.validate_and_list_from_input_s3_path(
                 s3_client=MockS3ClientGetNoObjectsFromS3(),
                 ssie_documents_s3_bucket='s3://bucket',
                 args=MockParserArgs(input_s3_path='s3://bucket/folder/documents/')
             )
-        
-        input_s3_path, local_dir = comprehend_ssie_annotation_tool_cli.validate_and_download_from_input_s3_path(
+
+        input_bucket, keys = comprehend_ssie_annotation_tool_cli.validate_and_list_from_input_s3_path(
             s3_client=MockS3Client(),
             ssie_documents_s3_bucket='s3://bucket',
             args=MockParserArgs(input_s3_path='s3://bucket/folder/documents/')
         )
-        self.assertEqual(len(get_all_files_in_directory(local_path=local_dir)), 3)
-        self.assertEqual(input_s3_path, 's3://bucket/folder/documents')
-
-        comprehend_ssie_annotation_tool_cli.cleanup(local_dir)
+        self.assertEqual(input_bucket, 'bucket')
+        self.assertListEqual(keys, ['folder/documents/file1.pdf', 'folder/documents/file2.pdf', 'folder/documents/file3.pdf'])
 
     def test_get_labels_from_schema_content(self):
         labels = ['label1', 'label2']
@@ -383,6 +369,38 @@ class ComprehendSSIEAnnotationToolCliTest(TestCase):
         self.assertEqual(received_schema_content, generate_schema_content())
         self.assertEqual(received_manifest_json_list, generate_manifest_json_list(secondary_annotation_ref_none=True))
 
+        received_manifest_json_list, received_schema_content = comprehend_ssie_annotation_tool_cli.generate_manifest_jsons_and_schema_for_verification_job(
+            sagemaker_client=MockSagemakerClient(),
+            s3_client=MockS3Client(),
+            ssie_documents_s3_bucket='s3://bucket',
+            annotator_metadata=None,
+            args=MockParserArgs(blind1_labeling_job_name='mock_job_name', blind2_labeling_job_name='mock_job_name')
+        )
+        self.assertEqual(received_schema_content, generate_schema_content())
+        self.assertEqual(received_manifest_json_list, generate_manifest_json_list())
+
+    def test_get_page_count_from_s3(self):
+        self.assertEqual(comprehend_ssie_annotation_tool_cli.get_page_count_from_s3(MockS3Client(), 'bucket', 'documents/scanned.pdf'), 5)
+
+        class MockS3ClientUnreadableObject(MockS3Client):
+            def open_object(self, bucket: str, key: str):
+                return open('test/unit/resources/pdfplumber_error/not_pdf.pdf', 'rb')
+
+        self.assertIsNone(comprehend_ssie_annotation_tool_cli.get_page_count_from_s3(MockS3ClientUnreadableObject(), 'bucket', 'documents/not_pdf.pdf'))
+
+        class MockS3ClientMissingObject(MockS3Client):
+            def open_object(self, bucket: str, key: str):
+                raise ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+
+        self.assertIsNone(comprehend_ssie_annotation_tool_cli.get_page_count_from_s3(MockS3ClientMissingObject(), 'bucket', 'documents/missing.pdf'))
+
+        class MockS3ClientBrokenObject(MockS3Client):
+            def open_object(self, bucket: str, key: str):
+                raise AttributeError('programming error')
+
+        with self.assertRaises(AttributeError):
+            comprehend_ssie_annotation_tool_cli.get_page_count_from_s3(MockS3ClientBrokenObject(), 'bucket', 'documents/broken.pdf')
+
     def test_generate_manifest_jsons_and_schema_for_standard_job(self):
         received_manifest_json_list, received_schema_content = comprehend_ssie_annotation_tool_cli.generate_manifest_jsons_and_schema_for_standard_job(
             s3_client=MockS3Client(),
@@ -391,6 +409,7 @@ class ComprehendSSIEAnnotationToolCliTest(TestCase):
             annotator_metadata=None,
             args=MockParserArgs(input_s3_path='s3://bucket/documents')
         )
+        received_manifest_json_list = list(received_manifest_json_list)
         self.assertEqual(received_schema_content, generate_schema_content())
         for obj in received_manifest_json_list:
             obj["primary-annotation-ref"] = None
@@ -406,6 +425,7 @@ class ComprehendSSIEAnnotationToolCliTest(TestCase):
             args=MockParserArgs(blind1_labeling_job_name='mock_job_name'),
             use_textract_only=False
         )
+        received_manifest_json_list = list(received_manifest_json_list)
         self.assertEqual(received_schema_content, generate_schema_content())
         self.assertEqual(received_manifest_json_list, generate_manifest_json_list(secondary_annotation_ref_none=True))
 
@@ -417,6 +437,7 @@ class ComprehendSSIEAnnotationToolCliTest(TestCase):
             annotator_metadata=None,
             args=MockParserArgs(input_s3_path='s3://bucket/documents')
         )
+        received_manifest_json_list = list(received_manifest_json_list)
         self.assertEqual(received_schema_content, generate_schema_content())
         for obj in received_manifest_json_list:
             obj["primary-annotation-ref"] = None
@@ -431,19 +452,19 @@ class ComprehendSSIEAnnotationToolCliTest(TestCase):
         )
         self.assertIsNone(received_labeling_job_name)
 
-        class MockSagemakerClientDescribeLabelingJobException():
+        class MockSagemakerClientNoLabelingJobs():
             """Mock Sagemaker client."""
-            def describe_labeling_job(self, LabelingJobName: str):
-                """Mock describe_labeling_job method."""
-                raise Exception()
+            def list_labeling_jobs(self, NameContains: str, MaxResults: int):
+                """Mock list_labeling_jobs method."""
+                return {'LabelingJobSummaryList': []}
         received_labeling_job_name = comprehend_ssie_annotation_tool_cli.validate_groundtruth_labeling_job_name(
-            sagemaker_client=MockSagemakerClientDescribeLabelingJobException(),
+            sagemaker_client=MockSagemakerClientNoLabelingJobs(),
             job_name_prefix='job_name',
             no_suffix=False
         )
         self.assertTrue(received_labeling_job_name.startswith('job_name-labeling-job-'))
         received_labeling_job_name = comprehend_ssie_annotation_tool_cli.validate_groundtruth_labeling_job_name(
-            sagemaker_client=MockSagemakerClientDescribeLabelingJobException(),
+            sagemaker_client=MockSagemakerClientNoLabelingJobs(),
             job_name_prefix='job_name',
             no_suffix=True
         )
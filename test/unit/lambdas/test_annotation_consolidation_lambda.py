@@ -2,10 +2,10 @@ from unittest import TestCase
 import json
 from unittest.mock import patch
 
-from lambdas.annotation_consolidation_lambda import get_annotation_file_name, get_annotation_file_path, get_annotation_obj, \
-    get_blocks_from_s3_ref, lambda_handler, remove_block_indices_from_blocks
+from lambdas.annotation_consolidation_lambda import do_consolidation, get_annotation_file_name, get_annotations_s3_prefix, get_annotation_obj, \
+    get_blocks_from_s3_ref, get_s3_client, lambda_handler, remove_block_indices_from_blocks, write_annotations
 from utils.block_helper import Block
-from type.semi_structured_annotation import SemiStructuredDocumentType
+from type.semi_structured_annotation import SemiStructuredAnnotation, SemiStructuredDocumentType
 from utils.s3_helper import S3Client
 
 
@@ -13,12 +13,12 @@ class MockS3Client(S3Client):
     def __init__(self):
         pass
 
-    def get_object_content_from_s3(self, s3_url: str):
+    def get_object_bytes_from_s3(self, s3_url: str):
         if 'consolidation-request' in s3_url:
-            with open('test/unit/resources/sample_consolidation_request/2021-11-18_02:19:51.json', 'r') as f:
+            with open('test/unit/resources/sample_consolidation_request/2021-11-18_02:19:51.json', 'rb') as f:
                 return f.read()
         else:
-            with open('test/unit/resources/sample_blocks/sample_file1_1_blocks.json', 'r') as f:
+            with open('test/unit/resources/sample_blocks/sample_file1_1_blocks.json', 'rb') as f:
                 return f.read()
 
     def write_content(self, s3_path: str, content):
@@ -29,12 +29,21 @@ class MockS3Client(S3Client):
 @patch('lambdas.annotation_consolidation_lambda.S3Client.bucket_key_from_s3_uri', S3Client.bucket_key_from_s3_uri)
 class AnnotationConsolidationLambdaTest(TestCase):
 
+    def setUp(self):
+        get_s3_client.cache_clear()
+
+    @patch('lambdas.annotation_consolidation_lambda.S3Client')
+    def test_get_s3_client(self, s3_client):
+        s3_client.return_value = MockS3Client()
+        self.assertIs(get_s3_client(), get_s3_client())
+        s3_client.assert_called_once_with()
+
     def test_remove_block_indices_from_blocks(self):
         blocks = [
-            Block(1, "LINE", "some_word another_word yet_another_word", 0).__dict__,
-            Block(1, "WORD", "some_word", 1, parent_block_index=0).__dict__,
-            Block(1, "WORD", "another_word", 2, parent_block_index=0).__dict__,
-            Block(1, "WORD", "yet_another_word", 3, parent_block_index=0).__dict__
+            Block(1, "LINE", "some_word another_word yet_another_word", 0).reprJSON(),
+            Block(1, "WORD", "some_word", 1, parent_block_index=0).reprJSON(),
+            Block(1, "WORD", "another_word", 2, parent_block_index=0).reprJSON(),
+            Block(1, "WORD", "yet_another_word", 3, parent_block_index=0).reprJSON()
         ]
         self.assertTrue(all(["parentBlockIndex" in b and "blockIndex" in b for b in blocks]))
         blocks = remove_block_indices_from_blocks(blocks)
@@ -49,7 +58,7 @@ class AnnotationConsolidationLambdaTest(TestCase):
     @patch("lambdas.annotation_consolidation_lambda.S3Client")
     def test_get_annotations(self, mock_s3_client):
         test_blocks = [{"BlockType": "LINE", "Id": "b7a47123-537e-41f9-b3bc-4e7646f28ad9", "Text": "Table of Contents", "Geometry": {"BoundingBox": {"Width": 0.11029728357421875, "Top": 0.05842941496959727, "Left": 0.05458785027452575, "Height": 0.011334459150469135}, "Polygon": [{"X": 0.05458785027452575, "Y": 0.05842941496959727}, {"X": 0.1648851338487445, "Y": 0.05842941496959727}, {"X": 0.1648851338487445, "Y": 0.0697638741200664}, {"X": 0.05458785027452575, "Y": 0.0697638741200664}]}, "Relationships": [{"Ids": ["3d7cb3f9-776b-498e-8db2-cc415e61dc92", "18f9300f-bcea-4af5-9f3a-6d12c15fe2ab", "4078ed92-e298-466f-9255-7b1929e15311"], "Type": "CHILD"}], "Page": 1}, {"BlockType": "WORD", "Id": "3d7cb3f9-776b-498e-8db2-cc415e61dc92", "Text": "Table", "Geometry": {"BoundingBox": {"Width": 0.034514469609507534, "Top": 0.05842941496959727, "Left": 0.05458785027452575, "Height": 0.011334459150469135}, "Polygon": [{"X": 0.05458785027452575, "Y": 0.05842941496959727}, {"X": 0.08910231988403328, "Y": 0.05842941496959727}, {"X": 0.08910231988403328, "Y": 0.0697638741200664}, {"X": 0.05458785027452575, "Y": 0.0697638741200664}]}, "Relationships": [], "Page": 1}, {"BlockType": "WORD", "Id": "18f9300f-bcea-4af5-9f3a-6d12c15fe2ab", "Text": "of", "Geometry": {"BoundingBox": {"Width": 0.01221866102521381, "Top": 0.05842941496959727, "Left": 0.09276933143804045, "Height": 0.011334459150469135}, "Polygon": [{"X": 0.09276933143804045, "Y": 0.05842941496959727}, {"X": 0.10498799246325426, "Y": 0.05842941496959727}, {"X": 0.10498799246325426, "Y": 0.0697638741200664}, {"X": 0.09276933143804045, "Y": 0.0697638741200664}]}, "Relationships": [], "Page": 1}, {"BlockType": "WORD", "Id": "4078ed92-e298-466f-9255-7b1929e15311", "Text": "Contents", "Geometry": {"BoundingBox": {"Width": 0.056230131074354706, "Top": 0.05842941496959727, "Left": 0.1086550027743898, "Height": 0.011334459150469135}, "Polygon": [{"X": 0.1086550027743898, "Y": 0.05842941496959727}, {"X": 0.1648851338487445, "Y": 0.05842941496959727}, {"X": 0.1648851338487445, "Y": 0.0697638741200664}, {"X": 0.1086550027743898, "Y": 0.0697638741200664}]}, "Relationships": [], "Page": 1}]
-        mock_s3_client.get_object_content_from_s3.return_value = json.dumps(test_blocks)
+        mock_s3_client.get_object_bytes_from_s3.return_value = json.dumps(test_blocks).encode('utf-8')
         annotation_map = json.dumps({
             "DocumentMetadata": {
                 "Pages": "10",
@@ -69,26 +78,45 @@ class AnnotationConsolidationLambdaTest(TestCase):
         self.assertTrue(annotations_obj.File.startswith("some_file_name-1"))
         self.assertEqual(annotations_obj.BlocksS3Ref, "s3://bucket/with/file/Some File & an Ampersand")
 
+        mock_s3_client.reset_mock()
+        inline_blocks = [dict(block, blockIndex=index, parentBlockIndex=-1) for index, block in enumerate(test_blocks)]
+        annotation_map = json.dumps({"DocumentMetadata": {"Pages": "10", "PageNumber": "2"}, "Blocks": inline_blocks})
+        annotations_obj = get_annotation_obj(annotation_map, mock_s3_client, "some_file_name")
+        self.assertListEqual(annotations_obj.Blocks, test_blocks)
+        mock_s3_client.get_object_bytes_from_s3.assert_not_called()
+
     def test_get_annotation_file_name(self):
         file_name = get_annotation_file_name("some_file_name", 4)
         self.assertTrue(file_name.startswith("some_file_name-4") and file_name.endswith("-ann.json"))
         self.assertEqual(len(file_name), len("some_file_name-4-12345678-ann.json"))
 
-    def test_get_annotation_file_path(self):
+    def test_get_annotations_s3_prefix(self):
         consolidation_request_annotation_json = "s3://comprehend-semi-structured-docs-us-west-2-123456789010/output/cus-semi-structured-b1-" \
             "part1-blind1a/annotations/consolidated-annotation/consolidation-request/iteration-1/2021-10-25_22:52:14.json"
-        annotation_file_name = "ANNOTATION_FILENAME-1-12345678-ann.json"
-        annotation_file_path = get_annotation_file_path(consolidation_request_annotation_json, annotation_file_name)
-        expected_file_path = "s3://comprehend-semi-structured-docs-us-west-2-123456789010/output/cus-semi-structured-b1-part1-blind1a/" \
-            f"annotations/consolidated-annotation/consolidation-response/iteration-1/annotations/{annotation_file_name}"
-        self.assertEqual(annotation_file_path, expected_file_path)
+        annotations_s3_prefix = get_annotations_s3_prefix(consolidation_request_annotation_json)
+        expected_prefix = "s3://comprehend-semi-structured-docs-us-west-2-123456789010/output/cus-semi-structured-b1-part1-blind1a/" \
+            "annotations/consolidated-annotation/consolidation-response/iteration-1/annotations"
+        self.assertEqual(annotations_s3_prefix, expected_prefix)
 
     def test_write_annotations(self):
-        pass
+        written = {}
+
+        class MockWriteS3Client(MockS3Client):
+            def write_content(self, s3_path: str, content):
+                written[s3_path] = content
+
+        annotations_obj = SemiStructuredAnnotation(Version="1234-56-78", File="some_file_name-1-12345678-ann.json")
+        write_annotations(annotations_obj, "s3://bucket/annotations/some_file_name-1-12345678-ann.json", MockWriteS3Client())
+        self.assertDictEqual(json.loads(written["s3://bucket/annotations/some_file_name-1-12345678-ann.json"]), annotations_obj.dict())
 
     def test_do_consolidation(self):
-        # tested in test_lambda_handler
-        pass
+        # the happy path is tested in test_lambda_handler
+        payload = [{"datasetObjectId": str(i), "annotations": []} for i in range(20)]
+        payload.insert(5, {"annotations": []})
+        consolidated_output = do_consolidation(payload, MockS3Client(), "arn:aws:sagemaker:us-west-2:123456789010:labeling-job/job", "job", None)
+        self.assertListEqual([response["datasetObjectId"] for response in consolidated_output], [str(i) for i in range(20)])
+        creation_dates = {response["consolidatedAnnotation"]["content"]["job-metadata"]["creation-date"] for response in consolidated_output}
+        self.assertEqual(len(creation_dates), 1)
 
     @patch('lambdas.annotation_consolidation_lambda.S3Client')
     def test_lambda_handler(self, s3_client):
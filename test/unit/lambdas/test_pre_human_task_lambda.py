@@ -1,15 +1,20 @@
 from typing import Union
 from unittest import TestCase
+import copy
+import io
 import tempfile
 import os
 import json
 from datetime import datetime
 from unittest.mock import patch
+from botocore.exceptions import ClientError
 
-from lambdas.pre_human_task_lambda import get_geometry_from_plumber_word, get_pdf_blocks, get_temp_folder_bucket_key_from_s3_uri, \
-    is_scanned_pdf, lambda_handler, output_pdf_temp_file_to_s3, plumber_line_to_blocks, textract_block_to_block, \
+from lambdas.pre_human_task_lambda import cache_pdf_blocks, get_cached_pdf_blocks, get_geometry_from_plumber_word, get_pdf_blocks, get_s3_client, \
+    get_temp_folder_bucket_key_from_s3_uri, get_textract_client, is_scanned_pdf, lambda_handler, output_pdf_base64_temp_file_to_s3, \
+    output_pdf_blocks_temp_file_to_s3, plumber_line_to_blocks, textract_block_to_block, \
     textract_block_to_block_relationship
 from utils.block_helper import Block, BoundingBox, Geometry, Relationship
+from constants import general
 from utils.s3_helper import S3Client
 from utils.textract_helper import TextractClient
 
@@ -28,8 +33,14 @@ class MockTextractClient(TextractClient):
 class MockStreamingBody(object):
     def __init__(self, s3_url: str):
         self.s3_url = s3_url
+        self.closed = False
+
+    def close(self):
+        self.closed = True
 
     def read(self):
+        if self.closed:
+            raise ValueError('read of closed body')
         filename = os.path.basename(self.s3_url)
         if '.pdf' in filename:
             with open(f'test/unit/resources/sample_documents/{filename}', 'rb') as f:
@@ -42,8 +53,11 @@ class MockStreamingBody(object):
 class MockS3Client(S3Client):
     def __init__(self, temp_dir: str = ''):
         self.temp_dir = temp_dir
+        self.written = {}
+        self.requested = []
 
     def write_content(self, s3_path: str, content: Union[str, list]):
+        self.written[s3_path] = content
         file_path = os.path.join(self.temp_dir, s3_path.replace('s3://', ''))
         os.makedirs(os.path.dirname(file_path), exist_ok=True)
         with open(file_path, 'w') as f:
@@ -52,7 +66,16 @@ class MockS3Client(S3Client):
             else:
                 content = str(content)
     
+    def object_exists(self, s3_url: str):
+        return s3_url in self.written
+
     def get_object_response_from_s3(self, s3_url: str):
+        self.requested.append(s3_url)
+        if s3_url in self.written:
+            content = self.written[s3_url]
+            return {'Body': io.BytesIO(content if type(content) == bytes else content.encode('utf-8')), 'LastModified': datetime.now()}
+        if general.BLOCKS_CACHE_FOLDER in s3_url:
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'The specified key does not exist.'}}, 'GetObject')
         return {'Body': MockStreamingBody(s3_url=s3_url), 'LastModified': datetime.now()}
 
 
@@ -60,6 +83,18 @@ class MockS3Client(S3Client):
 @patch('lambdas.pre_human_task_lambda.S3Client.bucket_key_from_s3_uri', S3Client.bucket_key_from_s3_uri)
 class PreHumanTaskLambdaTest(TestCase):
 
+    def setUp(self):
+        get_s3_client.cache_clear()
+        get_textract_client.cache_clear()
+
+    @patch('lambdas.pre_human_task_lambda.TextractClient')
+    @patch('lambdas.pre_human_task_lambda.S3Client')
+    def test_get_clients(self, s3_client, textract_client):
+        self.assertIs(get_s3_client(), get_s3_client())
+        s3_client.assert_called_once_with()
+        self.assertIs(get_textract_client(), get_textract_client())
+        textract_client.assert_called_once_with()
+
     def test_is_scanned_pdf(self):
         images = []
         self.assertFalse(is_scanned_pdf(images, 10, 10))
@@ -133,7 +168,22 @@ class PreHumanTaskLambdaTest(TestCase):
                 textract_client=None
             )
 
-    def test_output_pdf_temp_file_to_s3(self):
+    def test_blocks_cache(self):
+        with tempfile.TemporaryDirectory() as local_dir:
+            blocks_cache_s3_ref = 's3://bucket/blocks-cache/1_auto_blocks.json'
+            for cached_content in [b'{"IsNativePDF": true, "Blocks": [', b'{"Blocks": []}', b'[]']:
+                s3_client = MockS3Client(temp_dir=local_dir)
+                s3_client.written[blocks_cache_s3_ref] = cached_content
+                self.assertIsNone(get_cached_pdf_blocks(s3_client, blocks_cache_s3_ref))
+
+            s3_client = MockS3Client(temp_dir=local_dir)
+            cache_pdf_blocks(s3_client, blocks_cache_s3_ref, [{'BlockType': 'LINE'}], True)
+            self.assertEqual(get_cached_pdf_blocks(s3_client, blocks_cache_s3_ref), ([{'BlockType': 'LINE'}], True))
+
+            # failures of the cache write are only logged
+            cache_pdf_blocks(s3_client, blocks_cache_s3_ref, [object()], True)
+
+    def test_output_pdf_temp_files_to_s3(self):
         with tempfile.TemporaryDirectory() as local_dir:
             job_id = 'job_id'
             page_num = 1
@@ -142,11 +192,11 @@ class PreHumanTaskLambdaTest(TestCase):
             bytes_content = b'bytes_content'
             s3_client = MockS3Client(temp_dir=local_dir)
 
-            s3_write_path_str = output_pdf_temp_file_to_s3(s3_client, source_ref, content=bytes_content, page_num=page_num, job_id=job_id)
+            s3_write_path_str = output_pdf_base64_temp_file_to_s3(s3_client, source_ref, pdf_base64=bytes_content, page_num=page_num, job_id=job_id)
             self.assertEqual(s3_write_path_str, 's3://bucket/comprehend-semi-structured-docs-intermediate-output/job_id/file_1_base64')
             self.assertTrue(os.path.exists(os.path.join(local_dir, 'bucket/comprehend-semi-structured-docs-intermediate-output/job_id/file_1_base64')))
 
-            s3_write_path_str = output_pdf_temp_file_to_s3(s3_client, source_ref, content=list_content, page_num=page_num, job_id=job_id)
+            s3_write_path_str = output_pdf_blocks_temp_file_to_s3(s3_client, source_ref, pdf_blocks=list_content, page_num=page_num, job_id=job_id)
             self.assertEqual(s3_write_path_str, 's3://bucket/comprehend-semi-structured-docs-intermediate-output/job_id/file_1_blocks.json')
             self.assertTrue(os.path.exists(os.path.join(local_dir, 'bucket/comprehend-semi-structured-docs-intermediate-output/job_id/file_1_blocks.json')))
 
@@ -165,7 +215,7 @@ class PreHumanTaskLambdaTest(TestCase):
             'bottom': 9
         }
         geometry = get_geometry_from_plumber_word(word, page_width, page_height)
-        self.assertDictEqual(geometry.BoundingBox.__dict__, Geometry(0.6, 0.5, 0.1, 0.4).BoundingBox.__dict__)
+        self.assertDictEqual(geometry.BoundingBox.reprJSON(), Geometry(0.6, 0.5, 0.1, 0.4).BoundingBox.reprJSON())
 
     def test_plumber_line_to_blocks(self):
         plumber_line = [
@@ -194,7 +244,7 @@ class PreHumanTaskLambdaTest(TestCase):
         expected_blocks.insert(0, expected_line_block)
         self.assertEqual(block_index, 2)
         for index, b in enumerate(blocks):
-            self.assertDictEqual(b.Geometry.BoundingBox.__dict__, expected_blocks[index].Geometry.BoundingBox.__dict__)
+            self.assertDictEqual(b.Geometry.BoundingBox.reprJSON(), expected_blocks[index].Geometry.BoundingBox.reprJSON())
             if index == 0:
                 self.assertEqual(len(b.Relationships[0].Ids), len(expected_blocks[index].Relationships[0].Ids))
             else:
@@ -220,7 +270,7 @@ class PreHumanTaskLambdaTest(TestCase):
             }
         ]
         relationship = textract_block_to_block_relationship(textract_relationship_list=textract_relationship_list)
-        self.assertEqual(relationship.__dict__, Relationship(['id3', 'id4'], 'CHILD').__dict__)
+        self.assertEqual(relationship.reprJSON(), Relationship(['id3', 'id4'], 'CHILD').reprJSON())
 
     def test_textract_block_to_block(self):
         textract_block = {
@@ -241,8 +291,8 @@ class PreHumanTaskLambdaTest(TestCase):
             }]
         }
         block = textract_block_to_block(page=1, textract_block=textract_block, index=5, parent_index=3)
-        self.assertDictEqual(block.Geometry.BoundingBox.__dict__, BoundingBox(6, 10, 3, 5).__dict__)
-        self.assertEqual(block.Relationships[0].__dict__, Relationship(['id1', 'id2'], 'CHILD').__dict__)
+        self.assertDictEqual(block.Geometry.BoundingBox.reprJSON(), BoundingBox(6, 10, 3, 5).reprJSON())
+        self.assertEqual(block.Relationships[0].reprJSON(), Relationship(['id1', 'id2'], 'CHILD').reprJSON())
         self.assertEqual(block.BlockType, 'LINE')
         self.assertEqual(block.Text, 'textract block text')
         self.assertEqual(block.parentBlockIndex, 3)
@@ -276,6 +326,8 @@ class PreHumanTaskLambdaTest(TestCase):
                     }
                 }
             }
+            # lambda_handler updates the event's metadata in place
+            cached_event = copy.deepcopy(event)
             lambda_handler_output = lambda_handler(event=event, context=None)
             expected_lambda_handler_output = {
                 'taskInput': {
@@ -302,7 +354,16 @@ class PreHumanTaskLambdaTest(TestCase):
             }
             self.assertDictEqual(lambda_handler_output, expected_lambda_handler_output)
 
+            # the same page is served from the blocks cache the second time
+            blocks_cache_s3_refs = [s3_path for s3_path in s3_client.return_value.written if general.BLOCKS_CACHE_FOLDER in s3_path]
+            self.assertEqual(len(blocks_cache_s3_refs), 1)
+            self.assertTrue(blocks_cache_s3_refs[0].endswith('/1_auto_blocks.json'))
+            with patch('lambdas.pre_human_task_lambda.get_pdf_blocks') as get_pdf_blocks_mock:
+                self.assertDictEqual(lambda_handler(event=cached_event, context=None), expected_lambda_handler_output)
+                get_pdf_blocks_mock.assert_not_called()
+
         with tempfile.TemporaryDirectory() as local_dir:
+            get_s3_client.cache_clear()
             s3_client.return_value = MockS3Client(temp_dir=local_dir)
             # 1-job verification
             verification_event = {
@@ -323,6 +384,7 @@ class PreHumanTaskLambdaTest(TestCase):
                     "primary-annotation-ref": "s3://comprehend-semi-structured-docs-us-west-2-123456789010/output/test-labeling-job-20211214T084540/annotations/consolidated-annotation/consolidation-response/iteration-1/annotations/sample_file1-1-570408b2-ann.json",
                 }
             }
+            repeated_verification_event = copy.deepcopy(verification_event)
             verification_lambda_handler_output = lambda_handler(event=verification_event, context=None)
             verification_expected_lambda_handler_output = {
                 'taskInput': {
@@ -357,7 +419,16 @@ class PreHumanTaskLambdaTest(TestCase):
             }
             self.assertDictEqual(verification_lambda_handler_output, verification_expected_lambda_handler_output)
 
+            # the base64 file written by the first invocation is reused without requesting the PDF again
+            s3_client.return_value.requested.clear()
+            with patch('lambdas.pre_human_task_lambda.output_pdf_base64_temp_file_to_s3') as output_pdf_base64_mock:
+                self.assertDictEqual(lambda_handler(event=repeated_verification_event, context=None), verification_expected_lambda_handler_output)
+                output_pdf_base64_mock.assert_not_called()
+            self.assertNotIn(verification_event["dataObject"]["source-ref"], s3_client.return_value.requested)
+            self.assertIn(verification_event["dataObject"]["primary-annotation-ref"], s3_client.return_value.requested)
+
         with tempfile.TemporaryDirectory() as local_dir:
+            get_s3_client.cache_clear()
             s3_client.return_value = MockS3Client(temp_dir=local_dir)
             # 2-job verification
             two_verification_event = {
@@ -1,5 +1,7 @@
 from unittest import TestCase
-from utils.block_helper import Block, BoundingBox, Geometry, Point, Relationship, extend_polygon, get_points
+import uuid
+from utils.block_helper import Block, BoundingBox, DictionaryClass, Geometry, Point, Relationship, extend_polygon, generate_block_id, get_points, \
+    get_slots, union_bounding_boxes
 
 
 class BlockHelperTest(TestCase):
@@ -13,7 +15,12 @@ class BlockHelperTest(TestCase):
 
         bounding_box_extend = BoundingBox(10, 10, 10, 15)
         bounding_box.extend_bounding_box(bounding_box_extend)
-        self.assertEqual(bounding_box.__dict__, BoundingBox(15, 20, 5, 5).__dict__)
+        self.assertEqual(bounding_box.reprJSON(), BoundingBox(15, 20, 5, 5).reprJSON())
+
+    def test_union_bounding_boxes(self):
+        bounding_boxes = [BoundingBox(10, 10, 5, 5), BoundingBox(10, 20, 10, 5), BoundingBox(3, 4, 2, 8)]
+        self.assertEqual(union_bounding_boxes(bounding_boxes).reprJSON(), BoundingBox(18, 20, 2, 5).reprJSON())
+        self.assertEqual(union_bounding_boxes(bounding_boxes[:1]).reprJSON(), bounding_boxes[0].reprJSON())
 
     def test_point(self):
         point = Point(5, 10)
@@ -25,30 +32,32 @@ class BlockHelperTest(TestCase):
     def test_get_points(self):
         points = get_points(10, 20, 5, 10)
         self.assertEqual(len(points), 4)
-        self.assertEqual(points[0].__dict__, Point(5, 10).__dict__)
-        self.assertEqual(points[1].__dict__, Point(15, 10).__dict__)
-        self.assertEqual(points[2].__dict__, Point(15, 30).__dict__)
-        self.assertEqual(points[3].__dict__, Point(5, 30).__dict__)
+        self.assertEqual(points[0].reprJSON(), Point(5, 10).reprJSON())
+        self.assertEqual(points[1].reprJSON(), Point(15, 10).reprJSON())
+        self.assertEqual(points[2].reprJSON(), Point(15, 30).reprJSON())
+        self.assertEqual(points[3].reprJSON(), Point(5, 30).reprJSON())
     
     def test_extend_polygon(self):
         polygon = get_points(10, 20, 5, 10)
         polygon_extend = get_points(5, 15, 15, 30)
-        self.assertListEqual([p.__dict__ for p in extend_polygon(polygon, polygon_extend)], [p.__dict__ for p in get_points(15, 35, 5, 10)])
+        self.assertListEqual([p.reprJSON() for p in extend_polygon(polygon, polygon_extend)], [p.reprJSON() for p in get_points(15, 35, 5, 10)])
 
     def test_geometry(self):
         geometry = Geometry(10, 20, 5, 10)
         self.assertTrue(hasattr(geometry, "BoundingBox"))
         self.assertTrue(isinstance(geometry.BoundingBox, BoundingBox))
-        self.assertEqual(geometry.BoundingBox.__dict__, BoundingBox(10, 20, 5, 10).__dict__)
+        self.assertEqual(geometry.BoundingBox.reprJSON(), BoundingBox(10, 20, 5, 10).reprJSON())
         self.assertTrue(hasattr(geometry, "Polygon"))
         self.assertTrue(isinstance(geometry.Polygon, list))
         self.assertEqual(len(geometry.Polygon), 4)
-        self.assertListEqual([p.__dict__ for p in geometry.Polygon], [p.__dict__ for p in get_points(10, 20, 5, 10)])
+        self.assertListEqual([p.reprJSON() for p in geometry.Polygon], [p.reprJSON() for p in get_points(10, 20, 5, 10)])
+        self.assertListEqual(list(geometry.reprJSON()), ["BoundingBox", "Polygon"])
+        self.assertListEqual(geometry.reprJSON()["Polygon"], [p.reprJSON() for p in geometry.Polygon])
 
         geometry_extend = Geometry(10, 10, 10, 25)
         geometry.extend_geometry(geometry_extend)
-        self.assertEqual(geometry.BoundingBox.__dict__, BoundingBox(15, 25, 5, 10).__dict__)
-        self.assertListEqual([p.__dict__ for p in geometry.Polygon], [p.__dict__ for p in get_points(15, 25, 5, 10)])
+        self.assertEqual(geometry.BoundingBox.reprJSON(), BoundingBox(15, 25, 5, 10).reprJSON())
+        self.assertListEqual([p.reprJSON() for p in geometry.Polygon], [p.reprJSON() for p in get_points(15, 25, 5, 10)])
 
     def test_relationship(self):
         relationship = Relationship(["id1", "id2", "id3"], "CHILD")
@@ -61,12 +70,29 @@ class BlockHelperTest(TestCase):
         relationship = Relationship([], "CHILD")
         self.assertEqual(len(relationship.Ids), 0)
 
+    def test_repr_json_covers_slots(self):
+        objects = [BoundingBox(10, 20, 5, 10), Point(5, 10), Relationship(["id1"], "CHILD"), Block(1, "WORD", "Some_text.", 0)]
+        for obj in objects:
+            self.assertTupleEqual(tuple(obj.reprJSON()), get_slots(type(obj)))
+
+    def test_generate_block_id(self):
+        block_ids = {generate_block_id() for _ in range(1000)}
+        self.assertEqual(len(block_ids), 1000)
+        for block_id in block_ids:
+            parsed_id = uuid.UUID(block_id)
+            self.assertEqual(str(parsed_id), block_id)
+            self.assertEqual(parsed_id.version, 4)
+            self.assertEqual(parsed_id.variant, uuid.RFC_4122)
+
     def test_block(self):
         block_word = Block(1, "WORD", "Some_text.", 0, Geometry(10, 20, 5, 10), 0)
         self.assertTrue(hasattr(block_word, "BlockType"))
         self.assertTrue(isinstance(block_word.BlockType, str))
         self.assertTrue(hasattr(block_word, "Id"))
         self.assertTrue(isinstance(block_word.Id, str))
+        self.assertFalse(hasattr(block_word, "__dict__"))
+        self.assertIsNot(Block.reprJSON, DictionaryClass.reprJSON)
+        self.assertListEqual(list(block_word.reprJSON()), ["BlockType", "Id", "Text", "Geometry", "Relationships", "Page", "parentBlockIndex", "blockIndex"])
         self.assertTrue(hasattr(block_word, "Text"))
         self.assertTrue(isinstance(block_word.Text, str))
         self.assertTrue(hasattr(block_word, "Geometry"))
@@ -83,7 +109,13 @@ class BlockHelperTest(TestCase):
         block_line = Block(1, "LINE", "Some text.", 0)
         self.assertTrue(block_line.Geometry is None)
         self.assertTrue(block_line.parentBlockIndex == -1)
+        word_geometry = Geometry(10, 20, 5, 10)
+        block_line.extend_geometry(word_geometry)
+        self.assertIsNot(block_line.Geometry, word_geometry)
+        self.assertIsNot(block_line.Geometry.BoundingBox, word_geometry.BoundingBox)
+        self.assertEqual(block_line.Geometry.BoundingBox.reprJSON(), word_geometry.BoundingBox.reprJSON())
+        self.assertListEqual([p.reprJSON() for p in block_line.Geometry.Polygon], [p.reprJSON() for p in word_geometry.Polygon])
 
         block_word.extend_geometry(Geometry(10, 10, 10, 25))
-        self.assertEqual(block_word.Geometry.BoundingBox.__dict__, BoundingBox(15, 25, 5, 10).__dict__)
-        self.assertListEqual([p.__dict__ for p in block_word.Geometry.Polygon], [p.__dict__ for p in get_points(15, 25, 5, 10)])
+        self.assertEqual(block_word.Geometry.BoundingBox.reprJSON(), BoundingBox(15, 25, 5, 10).reprJSON())
+        self.assertListEqual([p.reprJSON() for p in block_word.Geometry.Polygon], [p.reprJSON() for p in get_points(15, 25, 5, 10)])
@@ -2,7 +2,7 @@ from unittest.case import TestCase
 import io
 import pdfplumber
 
-from utils.pdf_utils import get_pdf_bytes, get_pdf_page_bytes
+from utils.pdf_utils import get_pdf_bytes, get_pdf_page_bytes, get_pdf_page_count, get_pdf_page_count_from_stream
 
 
 class PDFUtilsTest(TestCase):
@@ -15,6 +15,18 @@ class PDFUtilsTest(TestCase):
         self.assertTrue(isinstance(received_pdf_page_bytes, bytes))
 
 
+    def test_get_pdf_page_count(self):
+        for sample_file_path in ['test/unit/resources/sample_documents/scanned.pdf', 'test/unit/resources/sample_documents/sample_file1.pdf']:
+            with pdfplumber.open(sample_file_path) as pdf:
+                self.assertEqual(get_pdf_page_count(sample_file_path), len(pdf.pages))
+
+        with self.assertRaises(Exception):
+            get_pdf_page_count('test/unit/resources/pdfplumber_error/not_pdf.pdf')
+
+    def test_get_pdf_page_count_from_stream(self):
+        with open('test/unit/resources/sample_documents/scanned.pdf', 'rb') as f:
+            self.assertEqual(get_pdf_page_count_from_stream(io.BytesIO(f.read())), 5)
+
     def test_get_pdf_bytes(self):
         pdf_path = 'test/unit/resources/sample_documents/sample_file1.pdf'
         pdf_bytes = get_pdf_bytes(pdf_path)
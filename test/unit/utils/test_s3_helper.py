@@ -1,15 +1,15 @@
 from unittest import TestCase
-from collections import namedtuple
+from unittest.mock import patch
+import json
 import tempfile
+import io
 from botocore.exceptions import ClientError
 
-from utils.s3_helper import S3Client
+from utils.s3_helper import S3Client, S3ObjectRangeReader, get_boto3_client_config
+from utils.pdf_utils import get_pdf_page_count_from_stream
+from constants import general
 
 
-def generate_s3_object(value=''):
-    """Generate an S3 object with a key attribute."""
-    return namedtuple("S3Object", ['key'])(value)
-
 class Object(object):
     pass
 
@@ -31,6 +31,30 @@ class MockS3Client(S3Client):
     def __init__(self, raise_exception=False, error=None):
         self.s3 = MockS3Resource(raise_exception=raise_exception, error=error)
 
+class MockDownloadS3Client(MockS3Client):
+    def __init__(self):
+        super().__init__()
+        self.downloaded = []
+
+    def get_keys_from_s3(self, bucket: str, filter_prefix: str = "", suffix: str = ""):
+        return [f'{filter_prefix}file{i}.pdf' for i in range(50)]
+
+    def download_file(self, local_path: str, bucket: str, s3_key: str):
+        self.downloaded.append((bucket, s3_key, local_path))
+
+class MockRangeBoto3S3Client(object):
+    def __init__(self, content: bytes):
+        self.content = content
+        self.ranges = []
+
+    def head_object(self, Bucket: str, Key: str):
+        return {'ContentLength': len(self.content)}
+
+    def get_object(self, Bucket: str, Key: str, Range: str):
+        self.ranges.append(Range)
+        start, end = [int(i) for i in Range[len('bytes='):].split('-')]
+        return {'Body': io.BytesIO(self.content[start:end + 1])}
+
 class S3HelperTest(TestCase):
 
     def test_s3_client_collect_s3_upload_file_arguments(self):
@@ -40,17 +64,64 @@ class S3HelperTest(TestCase):
             s3_path_prefix='upload/to/here'
         )
         self.assertEqual(len(file_data), 3)
+        self.assertListEqual(sorted(s3_key for _, s3_key, _ in file_data), [
+            'upload/to/here/dir_1/dir_2/file_2_1',
+            'upload/to/here/dir_1/dir_2/file_2_2',
+            'upload/to/here/file_1'
+        ])
+
+        with tempfile.TemporaryDirectory() as local_dir:
+            for file_name in ['index.html', 'main.JS', 'font.woff2', 'source.map']:
+                open(f'{local_dir}/{file_name}', 'w').close()
+            s3_client = MockS3Client()
+            file_data = s3_client._collect_s3_upload_file_arguments(local_path=local_dir, s3_path_prefix='upload/to/here')
+            extra_args_by_file = {local_path.split('/')[-1]: extra_args for local_path, _, extra_args in file_data}
+            self.assertDictEqual(extra_args_by_file, {
+                'index.html': {'ContentType': 'text/html'},
+                'main.JS': {'ContentType': 'application/javascript'},
+                'font.woff2': {'ContentType': 'font/woff2'},
+                'source.map': {}
+            })
     
+    def test_s3_client_upload_directory(self):
+        uploaded = []
+
+        class MockUploadS3Client(MockS3Client):
+            def upload_file(self, local_path: str, bucket: str, s3_key: str, extra_args):
+                uploaded.append((local_path, bucket, s3_key))
+
+        MockUploadS3Client().upload_directory(
+            local_dir_path='test/unit/resources/dir_collect_s3_upload_file_arguments',
+            bucket_name='bucket',
+            s3_path_prefix='upload/to/here'
+        )
+        self.assertEqual(len(uploaded), 3)
+        self.assertTrue(all(bucket == 'bucket' for _, bucket, _ in uploaded))
+
+        class MockFailingBoto3S3Client(object):
+            def upload_file(self, local_path: str, bucket: str, s3_key: str, ExtraArgs=None, Config=None):
+                if local_path.endswith('file_2_1'):
+                    raise ClientError({'Error': {'Code': 'AccessDenied', 'Message': 'Access Denied'}}, 'PutObject')
+
+        s3_client = MockS3Client()
+        s3_client.s3_client = MockFailingBoto3S3Client()
+        with self.assertRaises(ClientError):
+            s3_client.upload_directory(
+                local_dir_path='test/unit/resources/dir_collect_s3_upload_file_arguments',
+                bucket_name='bucket',
+                s3_path_prefix='upload/to/here'
+            )
+
     def test_s3_client_get_s3_download_file_args(self):
         with tempfile.TemporaryDirectory() as local_dir:
             s3_client = MockS3Client()
             args = [
-                generate_s3_object('folder1/file1.pdf'),
-                generate_s3_object('folder1/file1.json'),
-                generate_s3_object('folder1/folder2/file2.pdf'),
-                generate_s3_object('folder1/folder2/file2.txt'),
-                generate_s3_object('folder1/folder2/folder3/file3.pdf'),
-                generate_s3_object('folder1/folder2/folder3/file3.docx')
+                'folder1/file1.pdf',
+                'folder1/file1.json',
+                'folder1/folder2/file2.pdf',
+                'folder1/folder2/file2.txt',
+                'folder1/folder2/folder3/file3.pdf',
+                'folder1/folder2/folder3/file3.docx'
             ]
             s3_download_file_args = s3_client._get_s3_download_file_args(args, local_dir)
             self.assertListEqual(s3_download_file_args, [
@@ -59,6 +130,155 @@ class S3HelperTest(TestCase):
                 ('folder1/folder2/folder3/file3.pdf', f'{local_dir}/file3.pdf')
             ])
     
+    def test_s3_client_download_directory(self):
+        with tempfile.TemporaryDirectory() as local_dir:
+            s3_client = MockDownloadS3Client()
+            s3_client.download_directory(local_dir_path=local_dir, bucket_name='bucket', s3_path_prefix='folder1/')
+            self.assertListEqual(
+                sorted(s3_client.downloaded),
+                sorted([('bucket', f'folder1/file{i}.pdf', f'{local_dir}/file{i}.pdf') for i in range(50)])
+            )
+
+    def test_s3_client_get_keys_from_s3(self):
+        paginate_calls = []
+
+        class MockPaginator(object):
+            def paginate(self, **kwargs):
+                paginate_calls.append(kwargs)
+                if 'Delimiter' in kwargs:
+                    return [
+                        {'Contents': [{'Key': 'folder1/file1.pdf'}, {'Key': 'folder1/file1.json'}], 'CommonPrefixes': [{'Prefix': 'folder1/folder2/'}]},
+                        {'CommonPrefixes': [{'Prefix': 'folder1/folder3/'}]}
+                    ]
+                return [
+                    {'Contents': [{'Key': f"{kwargs['Prefix']}file2.pdf"}]},
+                    {'Contents': [{'Key': f"{kwargs['Prefix']}nested/file3.pdf"}]},
+                    {}
+                ]
+
+        class MockBoto3S3Client(object):
+            def get_paginator(self, operation_name: str):
+                self.operation_name = operation_name
+                return MockPaginator()
+
+        s3_client = MockS3Client()
+        s3_client.s3_client = MockBoto3S3Client()
+        self.assertListEqual(s3_client.get_keys_from_s3(bucket='bucket', filter_prefix='folder1/', suffix='.pdf'), [
+            'folder1/file1.pdf',
+            'folder1/folder2/file2.pdf',
+            'folder1/folder2/nested/file3.pdf',
+            'folder1/folder3/file2.pdf',
+            'folder1/folder3/nested/file3.pdf'
+        ])
+        self.assertEqual(len(s3_client.get_keys_from_s3(bucket='bucket', filter_prefix='folder1/')), 6)
+        self.assertEqual(s3_client.s3_client.operation_name, 'list_objects_v2')
+        self.assertDictEqual(paginate_calls[0], {'Bucket': 'bucket', 'Prefix': 'folder1/', 'Delimiter': '/', 'PaginationConfig': {'PageSize': 1000}})
+        self.assertIn({'Bucket': 'bucket', 'Prefix': 'folder1/folder3/', 'PaginationConfig': {'PageSize': 1000}}, paginate_calls)
+
+    def test_s3_client_write_content(self):
+        calls = []
+
+        class MockBoto3S3Client(object):
+            def put_object(self, Bucket: str, Key: str, Body: bytes):
+                calls.append(('put_object', Bucket, Key, Body))
+
+            def upload_fileobj(self, fileobj, bucket: str, key: str, Config=None):
+                calls.append(('upload_fileobj', bucket, key, fileobj.read()))
+
+        s3_client = MockS3Client()
+        s3_client.s3_client = MockBoto3S3Client()
+        s3_client.write_content(s3_path='s3://bucket/path/schema.json', content='{"tags": []}')
+        self.assertListEqual(calls, [('put_object', 'bucket', 'path/schema.json', b'{"tags": []}')])
+
+        large_content = b'0' * (general.S3_MULTIPART_THRESHOLD_BYTES + 1)
+        s3_client.write_content(s3_path='s3://bucket/path/large_file', content=large_content)
+        self.assertEqual(calls[-1], ('upload_fileobj', 'bucket', 'path/large_file', large_content))
+
+    def test_s3_client_write_jsonl(self):
+        written = {}
+
+        class MockBoto3S3Client(object):
+            def put_object(self, Bucket: str, Key: str, Body: bytes):
+                written[(Bucket, Key)] = ('put_object', Body)
+
+            def upload_fileobj(self, fileobj, bucket: str, key: str, Config=None):
+                written[(bucket, key)] = ('upload_fileobj', fileobj.read())
+
+        s3_client = MockS3Client()
+        s3_client.s3_client = MockBoto3S3Client()
+        rows = [{"source-ref": "s3://bucket/file1.pdf", "page": "1", "metadata": {"labels": ["PER", "LOC"]}}, {"page": "2"}]
+        s3_client.write_jsonl(s3_path='s3://bucket/input.manifest', rows=rows)
+        operation, content = written[('bucket', 'input.manifest')]
+        self.assertEqual(operation, 'put_object')
+        self.assertListEqual([json.loads(line) for line in content.decode('utf-8').splitlines()], rows)
+
+        s3_client.write_jsonl(s3_path='s3://bucket/generated.manifest', rows=(row for row in rows))
+        self.assertEqual(written[('bucket', 'generated.manifest')], written[('bucket', 'input.manifest')])
+
+        with patch.object(general, 'S3_MULTIPART_THRESHOLD_BYTES', len(content) - 1):
+            s3_client.write_jsonl(s3_path='s3://bucket/large.manifest', rows=rows)
+        self.assertEqual(written[('bucket', 'large.manifest')], ('upload_fileobj', content))
+
+    def test_s3_client_get_object_content_from_s3(self):
+        class MockBoto3S3Client(object):
+            def get_object(self, Bucket: str, Key: str):
+                return {'Body': io.BytesIO(f'{Bucket}/{Key} \u00e9'.encode('utf-8'))}
+
+        s3_client = MockS3Client()
+        s3_client.s3_client = MockBoto3S3Client()
+        self.assertEqual(s3_client.get_object_bytes_from_s3('s3://bucket/some/key'), 'bucket/some/key \u00e9'.encode('utf-8'))
+        self.assertEqual(s3_client.get_object_content_from_s3('s3://bucket/some/key'), 'bucket/some/key \u00e9')
+
+    def test_s3_client_object_exists(self):
+        class MockBoto3S3Client(object):
+            def head_object(self, Bucket: str, Key: str):
+                if Key == 'missing':
+                    raise ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+                if Key == 'forbidden':
+                    raise ClientError({'Error': {'Code': '403', 'Message': 'Forbidden'}}, 'HeadObject')
+                return {'ContentLength': 1}
+
+        s3_client = MockS3Client()
+        s3_client.s3_client = MockBoto3S3Client()
+        self.assertTrue(s3_client.object_exists('s3://bucket/existing'))
+        self.assertFalse(s3_client.object_exists('s3://bucket/missing'))
+        with self.assertRaises(ClientError):
+            s3_client.object_exists('s3://bucket/forbidden')
+
+    def test_s3_object_range_reader(self):
+        content = bytes(range(256)) * 40
+        boto3_client = MockRangeBoto3S3Client(content)
+        reader = S3ObjectRangeReader(boto3_client, 'bucket', 'key', block_size=1024)
+        self.assertEqual(reader.size, len(content))
+
+        reader.seek(-100, io.SEEK_END)
+        self.assertEqual(reader.read(), content[-100:])
+        self.assertEqual(reader.read(), b'')
+        reader.seek(1000)
+        self.assertEqual(reader.read(2000), content[1000:3000])
+        reader.seek(-500, io.SEEK_CUR)
+        self.assertEqual(reader.tell(), 2500)
+        self.assertEqual(reader.read(10), content[2500:2510])
+        self.assertListEqual(boto3_client.ranges, ['bytes=9216-10239', 'bytes=0-3071'])
+
+    def test_s3_object_range_reader_pdf_page_count(self):
+        with open('test/unit/resources/sample_documents/scanned.pdf', 'rb') as f:
+            content = f.read()
+        boto3_client = MockRangeBoto3S3Client(content)
+        reader = S3ObjectRangeReader(boto3_client, 'bucket', 'scanned.pdf')
+        self.assertEqual(get_pdf_page_count_from_stream(reader), 5)
+
+        fetched_bytes = 0
+        for fetched_range in boto3_client.ranges:
+            start, end = [int(i) for i in fetched_range[len('bytes='):].split('-')]
+            fetched_bytes += end - start + 1
+        self.assertLess(fetched_bytes, len(content) / 4)
+
+    def test_get_boto3_client_config(self):
+        config = get_boto3_client_config()
+        self.assertGreaterEqual(config.max_pool_connections, general.S3_TRANSFER_MAX_WORKERS)
+        self.assertDictEqual(config.retries, {'mode': 'standard', 'max_attempts': general.BOTO3_MAX_ATTEMPTS})
+
     def test_s3_client_bucket_key_from_s3_uri(self):
         bucket, key = S3Client.bucket_key_from_s3_uri('s3://bucket/path/to/file.pdf')
         self.assertEqual(bucket, 'bucket')